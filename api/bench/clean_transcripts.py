@@ -0,0 +1,87 @@
+"""Benchmark transcript cleaning on raw whisper.cpp output.
+
+Reports cleaning throughput and how many tokens cleaning saves, next to the
+line-by-line cleaner this replaced.
+
+Usage, from the api directory:
+
+    python -m bench.clean_transcripts /path/to/temp/*.wav.txt
+"""
+
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+
+from cleaner import clean_transcript
+from tokens import count_tokens
+
+
+def legacy_clean_transcript(transcript: str) -> str:
+    """The previous cleaner: strip timestamps and drop exact repeated lines."""
+    cleaned_lines = []
+    previous_line = None
+
+    for line in transcript.splitlines():
+        line = line.replace("\x00", "")
+        line = re.sub(r"\[.*?\]\s*", "", line)
+        if line != previous_line:
+            cleaned_lines.append(line)
+        previous_line = line
+
+    return "\n".join(cleaned_lines)
+
+
+def measure(clean, transcript: str, repeat: int) -> tuple[float, str]:
+    """Return the best time out of repeat runs, and the cleaned text."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cleaned = clean(transcript)
+        best = min(best, time.perf_counter() - start)
+    return best, cleaned
+
+
+def benchmark(path: Path, repeat: int) -> dict:
+    transcript = path.read_text(encoding="utf-8", errors="replace")
+    megabytes = len(transcript.encode("utf-8")) / 1e6
+    legacy_seconds, legacy = measure(legacy_clean_transcript, transcript, repeat)
+    seconds, cleaned = measure(clean_transcript, transcript, repeat)
+
+    legacy_tokens = count_tokens(legacy)
+    tokens = count_tokens(cleaned)
+    return {
+        "file": str(path),
+        "megabytes": round(megabytes, 3),
+        "legacy_mb_per_s": round(megabytes / legacy_seconds, 1),
+        "mb_per_s": round(megabytes / seconds, 1),
+        "raw_tokens": count_tokens(transcript),
+        "legacy_tokens": legacy_tokens,
+        "tokens": tokens,
+        "token_reduction": round(1 - tokens / legacy_tokens, 3) if legacy_tokens else 0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", type=Path, help="Raw whisper-cli output files")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per file; the fastest counts")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = [benchmark(path, args.repeat) for path in args.paths]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'file':40} {'MB':>8} {'MB/s':>8} {'old MB/s':>9} {'tokens':>9} {'old tokens':>11} {'saved':>6}")
+    for r in results:
+        print(
+            f"{Path(r['file']).name[:40]:40} {r['megabytes']:8.3f} {r['mb_per_s']:8.1f} {r['legacy_mb_per_s']:9.1f}"
+            f" {r['tokens']:9} {r['legacy_tokens']:11} {r['token_reduction']:6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
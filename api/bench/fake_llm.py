@@ -0,0 +1,174 @@
+"""Stand-in for an OpenAI-compatible chat completions API.
+
+Answers /chat/completions requests, streamed or not, after a configurable
+latency, generating the reply at a configurable speed. With --rpm set,
+requests over the limit get a 429 with Retry-After, like a rate-limited
+provider. GET /stats returns request counts for the benchmark report.
+
+Only needs the standard library, so it runs without the api's dependencies.
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = "the video covers how the pipeline was measured and which changes made it faster".split()
+
+
+class Stats:
+    """Request counters, shared by all handler threads."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.active = 0
+        self.peak_active = 0
+        self.prompt_chars = 0
+        self.recent: deque[float] = deque()
+
+    def admit(self, rpm: int) -> float:
+        """Count a request, and return how long it must wait if it is over the limit, else 0."""
+        with self.lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] >= 60:
+                self.recent.popleft()
+            if rpm and len(self.recent) >= rpm:
+                self.rate_limited += 1
+                return 60 - (now - self.recent[0])
+            self.recent.append(now)
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            return 0
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "rate_limited": self.rate_limited,
+                "peak_concurrency": self.peak_active,
+                "prompt_chars": self.prompt_chars,
+            }
+
+
+def make_handler(args: argparse.Namespace, stats: Stats) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        # Keep connections open, as the api's connection pool expects
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+        def send_json(self, status: int, body: dict, headers: dict | None = None) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_chunk(self, data: bytes) -> None:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/").endswith("/stats"):
+                self.send_json(200, stats.as_dict())
+            else:
+                self.send_json(404, {"error": {"message": "Not found"}})
+
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if not self.path.endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": "Not found"}})
+                return
+
+            retry_after = stats.admit(args.rpm)
+            if retry_after:
+                self.send_json(
+                    429,
+                    {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}},
+                    {"Retry-After": f"{retry_after:.1f}"},
+                )
+                return
+
+            try:
+                prompt_chars = sum(len(message.get("content") or "") for message in body.get("messages", []))
+                with stats.lock:
+                    stats.prompt_chars += prompt_chars
+                words = [WORDS[i % len(WORDS)] for i in range(args.summary_words)]
+                time.sleep(args.latency)
+                if body.get("stream"):
+                    self.stream(body, words)
+                else:
+                    time.sleep(len(words) / args.tokens_per_second)
+                    self.send_json(200, completion(body, " ".join(words), prompt_chars // 4, len(words)))
+            finally:
+                with stats.lock:
+                    stats.active -= 1
+
+        def stream(self, body: dict, words: list[str]) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, word in enumerate(words):
+                delta = {"content": word if i == 0 else f" {word}"}
+                self.send_chunk(f"data: {json.dumps(chunk(body, delta, None))}\n\n".encode())
+                time.sleep(1 / args.tokens_per_second)
+            self.send_chunk(f"data: {json.dumps(chunk(body, {}, 'stop'))}\n\n".encode())
+            self.send_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def completion(body: dict, content: str, prompt_tokens: int, completion_tokens: int) -> dict:
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "bench"),
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"},
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def chunk(body: dict, delta: dict, finish_reason: str | None) -> dict:
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "bench"),
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100, help="Generation speed")
+    parser.add_argument("--summary-words", type=int, default=200, help="Length of every reply")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before 429s, 0 = unlimited")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args, Stats()))
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Stand-in for whisper-cli that transcribes at a configurable speed.
+
+Accepts whisper-cli's arguments, reads the WAV file given with -f ("-" for
+stdin), sleeps as long as a real model would take at the given speed, and
+prints made-up but deterministic whisper-style output: the same audio always
+gets the same words, different audio gets different ones. Every
+--loop-every segments, whisper's habit of repeating itself is imitated.
+
+Only needs the standard library, so it runs without the api's dependencies.
+"""
+
+import argparse
+import hashlib
+import random
+import struct
+import sys
+import time
+
+WORDS = (
+    "the model we trained on this data set shows that performance depends mostly on how you measure it "
+    "so today I want to talk about latency throughput memory and what happens when the queue grows "
+    "first we look at the download step then transcription and finally the summary which costs tokens"
+).split()
+
+SEGMENT_SECONDS = 5.0
+
+
+def read_wav(path: str) -> tuple[bytes, float]:
+    """Return the samples of a PCM WAV file and their duration in seconds.
+
+    Piped WAV output from ffmpeg has no valid length in its header, so the
+    duration is computed from the number of bytes read.
+    """
+    data = sys.stdin.buffer.read() if path == "-" else open(path, "rb").read()  # noqa: SIM115
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("not a WAV file")
+
+    offset = 12
+    byte_rate = None
+    while offset + 8 <= len(data):
+        chunk_id, size = data[offset : offset + 4], struct.unpack("<I", data[offset + 4 : offset + 8])[0]
+        if chunk_id == b"fmt ":
+            byte_rate = struct.unpack("<I", data[offset + 16 : offset + 20])[0]
+        elif chunk_id == b"data":
+            samples = data[offset + 8 :]
+            if not byte_rate:
+                raise ValueError("no fmt chunk before the data chunk")
+            return samples, len(samples) / byte_rate
+        offset += 8 + size + size % 2
+    raise ValueError("no data chunk")
+
+
+def format_timestamp(seconds: float) -> str:
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def fake_segments(samples: bytes, duration: float, loop_every: int) -> list[str]:
+    rng = random.Random(hashlib.sha256(samples).digest())
+    lines = []
+    start = 0.0
+    segment = 0
+    while start < duration:
+        end = min(duration, start + SEGMENT_SECONDS)
+        text = " ".join(rng.choices(WORDS, k=rng.randint(8, 14))).capitalize() + "."
+        segment += 1
+        copies = rng.randint(3, 6) if loop_every and segment % loop_every == 0 else 1
+        for _ in range(copies):
+            lines.append(f"[{format_timestamp(start)} --> {format_timestamp(end)}]   {text}")
+        start = end
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0], allow_abbrev=False)
+    parser.add_argument("-f", dest="file", required=True, help="WAV file, or - for stdin")
+    parser.add_argument("--speed", type=float, default=20, help="Seconds of audio transcribed per second")
+    parser.add_argument("--load-seconds", type=float, default=0.5, help="Time to load the model")
+    parser.add_argument("--loop-every", type=int, default=20, help="Repeat every nth segment, 0 never")
+    # Model, thread and decoding options are accepted and ignored
+    args, _ = parser.parse_known_args()
+
+    try:
+        samples, duration = read_wav(args.file)
+    except (OSError, ValueError) as e:
+        print(f"error: failed to read audio: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    time.sleep(args.load_seconds + duration / args.speed)
+    print("\n".join(fake_segments(samples, duration, args.loop_every)))
+
+
+if __name__ == "__main__":
+    main()
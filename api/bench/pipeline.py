@@ -0,0 +1,503 @@
+"""Benchmark the whole pipeline end to end, against local stand-ins.
+
+Starts app.py (API and daemon) on a fresh database, submits generated videos
+through POST /entries, and polls the API with concurrent clients until every
+video is done. Reports throughput, per-stage latency, peak memory and disk
+use, and API latency, and can write them as JSON to compare against a
+baseline run.
+
+Everything runs locally:
+
+- Videos are generated audio files, served over HTTP and downloaded by
+  yt-dlp's generic extractor.
+- whisper-cli is bench/fake_whisper.py, at a configurable speed.
+- The LLM is bench/fake_llm.py, with configurable latency and rate limit.
+
+ffmpeg is the real one and must be installed. Pipeline settings are passed
+with --env, e.g. to compare a change against a baseline, from the api
+directory:
+
+    python -m bench.pipeline --videos 20 --output baseline.json
+    python -m bench.pipeline --videos 20 --env SUMMARIZE_WORKERS=1 --baseline baseline.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shlex
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+API_DIR = Path(__file__).resolve().parent.parent
+FAKE_WHISPER = Path(__file__).resolve().parent / "fake_whisper.py"
+
+# Settings that differ from production defaults but can be overridden with --env
+DEFAULT_SETTINGS = {
+    # Every video comes from the same local host; no need to space out requests
+    "DOWNLOAD_HOST_INTERVAL": "0",
+    "WHISPER_BACKEND": "cli",
+}
+
+FINISHED_STATUSES = {"done", "error"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values: list[float]) -> dict:
+    """Return count, p50, p95 and max of values (nearest rank)."""
+    ordered = sorted(values)
+
+    def rank(q: float) -> float | None:
+        if not ordered:
+            return None
+        return round(ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)], 3)
+
+    return {"count": len(ordered), "p50": rank(0.5), "p95": rank(0.95), "max": rank(1)}
+
+
+def generate_media(media_dir: Path, count: int, seconds: float, seed: int) -> dict[str, float]:
+    """Generate count audio files of about seconds each, reusing ones from earlier runs.
+
+    Every file is a different tone, so every fake transcript differs and no
+    summary comes from the cache.
+
+    Returns:
+        dict: Duration in seconds by video name.
+
+    """
+    media_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    durations = {}
+    for i in range(count):
+        name = f"video-{i:04d}"
+        duration = round(seconds * rng.uniform(0.5, 1.5), 1)
+        path = media_dir / f"{name}-{duration:g}s.m4a"
+        if not path.exists():
+            subprocess.run(
+                [
+                    "ffmpeg",
+                    "-nostdin",
+                    "-loglevel",
+                    "error",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    f"sine=frequency={200 + i}:sample_rate=16000:duration={duration}",
+                    "-c:a",
+                    "aac",
+                    "-b:a",
+                    "32k",
+                    str(path),
+                ],
+                check=True,
+            )
+        durations[path.name] = duration
+    return durations
+
+
+def install_fake_whisper(whisper_dir: Path, speed: float, load_seconds: float) -> None:
+    """Put a whisper-cli running fake_whisper.py where the transcriber looks for it."""
+    binary = whisper_dir / "build/bin/whisper-cli"
+    binary.parent.mkdir(parents=True, exist_ok=True)
+    binary.write_text(
+        "#!/bin/sh\n"
+        f"exec {shlex.quote(sys.executable)} {shlex.quote(str(FAKE_WHISPER))}"
+        f' --speed {speed} --load-seconds {load_seconds} "$@"\n'
+    )
+    binary.chmod(0o755)
+
+
+def process_tree_rss(pid: int) -> int | None:
+    """Return the resident memory in bytes of a process and all its descendants (Linux only)."""
+    proc = Path("/proc")
+    if not proc.exists():
+        return None
+
+    children: dict[int, list[int]] = {}
+    for stat in proc.glob("[0-9]*/stat"):
+        try:
+            # The command name can contain spaces, so split after its closing parenthesis
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            total += int((proc / str(current) / "statm").read_text().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            continue
+        pending.extend(children.get(current, []))
+    return total
+
+
+def peak_rss(pid: int) -> int | None:
+    """Return the peak resident memory in bytes of a single process (Linux only)."""
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def disk_usage(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    total = 0
+    for file in path.rglob("*"):
+        try:
+            total += file.stat().st_size if file.is_file() else 0
+        except OSError:
+            # Removed while walking
+            continue
+    return total
+
+
+class Poller(threading.Thread):
+    """Poll the entry list and summaries like an open browser tab, recording latencies."""
+
+    def __init__(self, base_url: str, interval: float, stop: threading.Event, rng: random.Random) -> None:
+        super().__init__(daemon=True)
+        self.client = httpx.Client(base_url=base_url, timeout=30)
+        self.interval = interval
+        self.stop = stop
+        self.rng = rng
+        self.latencies: dict[str, list[float]] = {"list": [], "summary": []}
+        self.errors = {"list": 0, "summary": 0}
+
+    def timed_get(self, endpoint: str, url: str, headers: dict | None = None) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            response = self.client.get(url, headers=headers)
+        except httpx.HTTPError:
+            self.errors[endpoint] += 1
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        if response.status_code >= 500:
+            self.errors[endpoint] += 1
+        return response
+
+    def run(self) -> None:
+        etag = None
+        entries: list[dict] = []
+        # Spread the pollers out instead of firing in lockstep
+        self.stop.wait(self.rng.uniform(0, self.interval))
+        while not self.stop.is_set():
+            response = self.timed_get("list", "/entries?limit=50", {"If-None-Match": etag} if etag else None)
+            if response is not None and response.status_code == 200:
+                etag = response.headers.get("ETag")
+                entries = response.json()
+
+            with_summary = [entry for entry in entries if entry.get("has_summary")]
+            if with_summary:
+                self.timed_get("summary", f"/entries/{self.rng.choice(with_summary)['id']}/summary")
+            self.stop.wait(self.interval)
+        self.client.close()
+
+
+def wait_for_api(client: httpx.Client, app: subprocess.Popen, log_path: Path) -> None:
+    for _ in range(300):
+        if app.poll() is not None:
+            sys.exit(f"app.py exited with code {app.returncode}, see {log_path}")
+        try:
+            client.get("/entries?limit=1").raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    sys.exit(f"API did not start, see {log_path}")
+
+
+def stage_latencies(database_path: Path) -> dict:
+    """Summarize the timings the pipeline recorded, per stage and step."""
+    durations: dict[str, list[float]] = {}
+    failures: dict[str, int] = {}
+    with sqlite3.connect(database_path) as connection:
+        for stage, duration, success in connection.execute("SELECT stage, duration, success FROM stagetiming"):
+            durations.setdefault(stage, []).append(duration)
+            failures[stage] = failures.get(stage, 0) + (not success)
+    return {
+        stage: {**percentiles(values), "failures": failures[stage], "total": round(sum(values), 3)}
+        for stage, values in sorted(durations.items())
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def run(args: argparse.Namespace, work_dir: Path) -> dict:
+    media_dir = work_dir / "media"
+    database_path = work_dir / "summarize.db"
+    temp_dir = work_dir / "temp"
+    log_path = work_dir / "app.log"
+    # Start from an empty database and temp dir; generated media is reused
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    for path in work_dir.glob("summarize.db*"):
+        path.unlink()
+    temp_dir.mkdir()
+
+    durations = generate_media(media_dir, args.videos, args.video_seconds, args.seed)
+    install_fake_whisper(work_dir / "whisper.cpp", args.whisper_speed, args.whisper_load_seconds)
+
+    media_port, llm_port, api_port, wakeup_port = (free_port() for _ in range(4))
+    overrides = dict(setting.split("=", 1) for setting in args.env)
+    env = {
+        **os.environ,
+        **DEFAULT_SETTINGS,
+        **overrides,
+        "DATABASE_PATH": str(database_path),
+        "TEMP_DIR": str(temp_dir),
+        "WHISPER_BASE_DIR": str(work_dir / "whisper.cpp"),
+        "LLM_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+        "OPENROUTER_API_KEY": "bench",
+        "API_HOST": "127.0.0.1",
+        "API_PORT": str(api_port),
+        "WAKEUP_PORT": str(wakeup_port),
+        "PYTHONUNBUFFERED": "1",
+    }
+
+    fakes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "http.server", str(media_port), "--bind", "127.0.0.1", "--directory", media_dir],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ),
+        subprocess.Popen(
+            [
+                sys.executable,
+                str(Path(__file__).resolve().parent / "fake_llm.py"),
+                f"--port={llm_port}",
+                f"--latency={args.llm_latency}",
+                f"--tokens-per-second={args.llm_tokens_per_second}",
+                f"--summary-words={args.summary_words}",
+                f"--rpm={args.llm_rpm}",
+            ]
+        ),
+    ]
+    stop = threading.Event()
+    with log_path.open("w") as log_file:
+        app = subprocess.Popen(
+            [sys.executable, "app.py"], cwd=API_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT
+        )
+    client = httpx.Client(base_url=f"http://127.0.0.1:{api_port}", timeout=30)
+    try:
+        wait_for_api(client, app, log_path)
+
+        rng = random.Random(args.seed)
+        pollers = [
+            Poller(f"http://127.0.0.1:{api_port}", args.poll_interval, stop, random.Random(rng.random()))
+            for _ in range(args.pollers)
+        ]
+        for poller in pollers:
+            poller.start()
+
+        started = time.monotonic()
+        for name in durations:
+            client.post("/entries", json={"url": f"http://127.0.0.1:{media_port}/{name}"}).raise_for_status()
+
+        entries: list[dict] = []
+        peak_tree_rss = 0
+        peak_temp = peak_database = 0
+        while time.monotonic() - started < args.timeout:
+            entries = client.get("/entries").json()
+            peak_tree_rss = max(peak_tree_rss, process_tree_rss(app.pid) or 0)
+            peak_temp = max(peak_temp, disk_usage(temp_dir))
+            peak_database = max(peak_database, sum(disk_usage(path) for path in work_dir.glob("summarize.db*")))
+            if len(entries) == len(durations) and all(entry["status"] in FINISHED_STATUSES for entry in entries):
+                break
+            if app.poll() is not None:
+                sys.exit(f"app.py exited with code {app.returncode}, see {log_path}")
+            time.sleep(0.5)
+        wall_seconds = time.monotonic() - started
+        app_peak_rss = peak_rss(app.pid)
+        llm_stats = httpx.get(f"http://127.0.0.1:{llm_port}/stats").json()
+    finally:
+        stop.set()
+        client.close()
+        for process in [app, *fakes]:
+            process.terminate()
+        for process in [app, *fakes]:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    statuses = [entry["status"] for entry in entries]
+    done = [entry for entry in entries if entry["status"] == "done"]
+    audio_seconds = sum(durations.get(entry["url"].rsplit("/", 1)[-1], 0) for entry in done)
+    entry_seconds = [
+        (datetime.fromisoformat(entry["updated_at"]) - datetime.fromisoformat(entry["insertion_date"])).total_seconds()
+        for entry in done
+    ]
+    api_latencies: dict[str, dict] = {}
+    for endpoint in ["list", "summary"]:
+        latencies = [latency * 1000 for poller in pollers for latency in poller.latencies[endpoint]]
+        errors = sum(poller.errors[endpoint] for poller in pollers)
+        api_latencies[endpoint] = {**percentiles(latencies), "errors": errors, "unit": "ms"}
+
+    megabyte = 1024 * 1024
+    return {
+        "label": args.label,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "settings": {
+            "videos": args.videos,
+            "video_seconds": args.video_seconds,
+            "seed": args.seed,
+            "pollers": args.pollers,
+            "poll_interval": args.poll_interval,
+            "whisper_speed": args.whisper_speed,
+            "whisper_load_seconds": args.whisper_load_seconds,
+            "llm_latency": args.llm_latency,
+            "llm_tokens_per_second": args.llm_tokens_per_second,
+            "llm_rpm": args.llm_rpm,
+            "summary_words": args.summary_words,
+            "env": {**DEFAULT_SETTINGS, **overrides},
+        },
+        "videos": {
+            "submitted": len(durations),
+            "done": statuses.count("done"),
+            "error": statuses.count("error"),
+            "unfinished": len(durations) - statuses.count("done") - statuses.count("error"),
+        },
+        "wall_seconds": round(wall_seconds, 3),
+        "videos_per_hour": round(len(done) / wall_seconds * 3600, 1),
+        "audio_seconds_per_second": round(audio_seconds / wall_seconds, 2),
+        "entry_seconds": percentiles(entry_seconds),
+        "stages": stage_latencies(database_path),
+        "peak_rss_mb": {
+            "app": round(app_peak_rss / megabyte, 1) if app_peak_rss else None,
+            "app_and_children": round(peak_tree_rss / megabyte, 1) if peak_tree_rss else None,
+        },
+        "peak_disk_mb": {
+            "temp": round(peak_temp / megabyte, 2),
+            "database": round(peak_database / megabyte, 2),
+        },
+        "api_ms": api_latencies,
+        "llm": llm_stats,
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    """Flatten nested results into "a.b" keys, keeping only the numbers."""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def print_comparison(results: dict, baseline: dict) -> None:
+    """Print every metric next to the baseline's, with the relative change."""
+    current, previous = flatten(results), flatten(baseline)
+    print(f"{'metric':45} {'baseline':>12} {'current':>12} {'change':>8}")
+    for key, value in current.items():
+        if key.startswith("settings.") or key not in previous:
+            continue
+        change = f"{(value - previous[key]) / previous[key]:+8.1%}" if previous[key] else f"{'':>8}"
+        print(f"{key:45} {previous[key]:12g} {value:12g} {change}")
+
+
+def print_results(results: dict) -> None:
+    videos = results["videos"]
+    print(
+        f"{videos['done']}/{videos['submitted']} videos done ({videos['error']} errors)"
+        f" in {results['wall_seconds']:.1f}s: {results['videos_per_hour']} videos/hour,"
+        f" {results['audio_seconds_per_second']}x realtime"
+    )
+    print(f"\n{'stage':20} {'count':>6} {'p50 s':>9} {'p95 s':>9} {'max s':>9} {'failed':>7}")
+    for stage, stats in results["stages"].items():
+        print(
+            f"{stage:20} {stats['count']:6} {stats['p50']:9.3f} {stats['p95']:9.3f} {stats['max']:9.3f}"
+            f" {stats['failures']:7}"
+        )
+    print(f"\n{'endpoint':20} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'errors':>7}")
+    for endpoint, stats in results["api_ms"].items():
+        if stats["count"]:
+            print(
+                f"{endpoint:20} {stats['count']:6} {stats['p50']:9.1f} {stats['p95']:9.1f} {stats['max']:9.1f}"
+                f" {stats['errors']:7}"
+            )
+    print(f"\npeak RSS (MB): {results['peak_rss_mb']}")
+    print(f"peak disk (MB): {results['peak_disk_mb']}")
+    print(f"LLM: {results['llm']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0], formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--videos", type=int, default=10, help="Videos to submit")
+    parser.add_argument("--video-seconds", type=float, default=120, help="Average video length")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for video lengths and polling")
+    parser.add_argument("--pollers", type=int, default=5, help="Concurrent API clients")
+    parser.add_argument("--poll-interval", type=float, default=1, help="Seconds between each client's polls")
+    parser.add_argument("--whisper-speed", type=float, default=20, help="Seconds of audio transcribed per second")
+    parser.add_argument("--whisper-load-seconds", type=float, default=0.5, help="Model load time per whisper run")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds before the LLM's first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=100, help="LLM generation speed")
+    parser.add_argument("--llm-rpm", type=int, default=0, help="LLM requests per minute before 429s, 0 = unlimited")
+    parser.add_argument("--summary-words", type=int, default=200, help="Length of every LLM reply")
+    parser.add_argument(
+        "--env", action="append", default=[], metavar="KEY=VALUE", help="Pipeline setting, can be repeated"
+    )
+    parser.add_argument("--timeout", type=float, default=1800, help="Give up after this many seconds")
+    parser.add_argument("--work-dir", type=Path, help="Keep media, database and logs here (default: a temp dir)")
+    parser.add_argument("--label", default="", help="Name for this run in the results")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", type=Path, help="Compare against results written by an earlier run")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg"):
+        sys.exit("ffmpeg is required")
+    if any("=" not in setting for setting in args.env):
+        sys.exit("--env takes KEY=VALUE")
+
+    if args.work_dir:
+        args.work_dir.mkdir(parents=True, exist_ok=True)
+        results = run(args, args.work_dir.resolve())
+    else:
+        with tempfile.TemporaryDirectory(prefix="summarize-bench-") as work_dir:
+            results = run(args, Path(work_dir))
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+    if args.baseline:
+        print()
+        print_comparison(results, json.loads(args.baseline.read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Content-addressed cache for transcripts and summaries.
+
+Transcripts are keyed by a hash of the audio and the whisper settings that
+produced them. A second key, made of the video's canonical id and the whisper
+settings, points to that transcript key, so a video can be found before its
+audio is downloaded. Summaries are keyed by a hash of the transcript and the
+LLM settings. The least recently used items are evicted once the cache grows
+beyond CACHE_MAX_BYTES.
+"""
+
+import hashlib
+import re
+from datetime import datetime, timezone
+from pathlib import Path
+
+import structlog
+from peewee import fn
+
+from config import (
+    CACHE_MAX_BYTES,
+    LLM_MODEL,
+    LLM_TEMPERATURE,
+    SUMMARY_CHUNK_TOKENS,
+    SUMMARY_TOKEN_BUDGET,
+    WHISPER_BEAM_SIZE,
+    WHISPER_ENTROPY_THRESHOLD,
+    WHISPER_LANGUAGE,
+    WHISPER_MAX_CONTEXT,
+    WHISPER_MODEL,
+    WHISPER_SUPPRESS_NON_SPEECH,
+)
+from model import CacheItem
+from summarizer import SUMMARY_PROMPT
+
+log = structlog.get_logger()
+
+# youtu.be/<id>, youtube.com/watch?v=<id>&t=30, /shorts/<id>, /embed/<id>, /live/<id>
+YOUTUBE_ID_PATTERN = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([\w-]{11})"
+)
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with Path.open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def canonical_video_id(url: str) -> str:
+    """Return an id that is the same for every URL form of a video."""
+    match = YOUTUBE_ID_PATTERN.search(url)
+    if match:
+        return f"youtube:{match.group(1)}"
+    return url.split("#")[0]
+
+
+def whisper_settings() -> str:
+    return hash_text(
+        f"{WHISPER_MODEL.name}|{WHISPER_LANGUAGE}|{WHISPER_ENTROPY_THRESHOLD}|"
+        f"{WHISPER_BEAM_SIZE}|{WHISPER_MAX_CONTEXT}|{WHISPER_SUPPRESS_NON_SPEECH}"
+    )[:16]
+
+
+def llm_settings() -> str:
+    return hash_text(
+        f"{LLM_MODEL}|{LLM_TEMPERATURE}|{SUMMARY_CHUNK_TOKENS}|{SUMMARY_TOKEN_BUDGET}|{SUMMARY_PROMPT}"
+    )[:16]
+
+
+def video_transcript_key(url: str) -> str:
+    return f"transcript:video:{canonical_video_id(url)}:{whisper_settings()}"
+
+
+def audio_transcript_key(audio_path: Path) -> str:
+    return f"transcript:audio:{hash_file(audio_path)}:{whisper_settings()}"
+
+
+def summary_key(transcript: str) -> str:
+    return f"summary:{hash_text(transcript)}:{llm_settings()}"
+
+
+def get_video_transcript(url: str) -> str | None:
+    """Return the cached transcript of a video, under any of its URL forms."""
+    audio_key = get(video_transcript_key(url))
+    return get(audio_key) if audio_key else None
+
+
+def link_video_transcript(url: str, audio_key: str) -> None:
+    """Make the transcript stored under audio_key findable by the video's URL."""
+    put(video_transcript_key(url), audio_key)
+
+
+def get(key: str) -> str | None:
+    """Return the cached value for a key, or None."""
+    if CACHE_MAX_BYTES <= 0:
+        return None
+
+    item = CacheItem.get_or_none(CacheItem.key == key)
+    if item is None:
+        return None
+
+    CacheItem.update(last_used=datetime.now(timezone.utc)).where(CacheItem.id == item.id).execute()
+    log.info(f"Cache hit: {key}")
+    return item.value
+
+
+def put(key: str, value: str) -> None:
+    """Store a value, then evict least recently used items if over CACHE_MAX_BYTES."""
+    if CACHE_MAX_BYTES <= 0:
+        return
+
+    size = len(value.encode())
+    (
+        CacheItem.insert(key=key, value=value, size=size, last_used=datetime.now(timezone.utc))
+        .on_conflict(
+            conflict_target=[CacheItem.key],
+            preserve=[CacheItem.value, CacheItem.size, CacheItem.last_used],
+        )
+        .execute()
+    )
+    evict()
+
+
+def evict() -> None:
+    total = CacheItem.select(fn.SUM(CacheItem.size)).scalar() or 0
+    if total <= CACHE_MAX_BYTES:
+        return
+
+    evicted = []
+    items = CacheItem.select(CacheItem.id, CacheItem.size).order_by(CacheItem.last_used.asc())
+    for item in items:
+        if total <= CACHE_MAX_BYTES:
+            break
+        evicted.append(item.id)
+        total -= item.size
+
+    CacheItem.delete().where(CacheItem.id.in_(evicted)).execute()
+    log.info(f"Evicted {len(evicted)} items from the cache")
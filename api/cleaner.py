@@ -0,0 +1,167 @@
+"""Clean up whisper.cpp transcripts before they are stored and summarized.
+
+Cleaning is a single streaming pass over the whisper output, one line at a
+time, through these steps:
+
+1. Timestamps and null bytes are removed.
+2. Segments that repeat a recent one, ignoring case and surrounding punctuation,
+   are dropped, and runs of three or more nearly identical segments are
+   collapsed to the first. Whisper produces these when it gets stuck
+   repeating itself. Two similar segments in a row are kept: speakers do
+   that too, e.g. "Revenue grew 10 percent." and "Revenue grew 12 percent.".
+3. Segments that don't end a sentence are merged with the following ones.
+4. Phrases repeated three or more times in a row within a sentence are
+   collapsed, e.g. "and then and then and then".
+"""
+
+import re
+import string
+from collections import deque
+from collections.abc import Iterable, Iterator
+
+# Timestamps (e.g. "[00:00:00.000 --> 00:00:02.000]") and other bracketed tags
+TIMESTAMP_PATTERN = re.compile(r"\[[^\]]*\]\s*")
+SENTENCE_END_PATTERN = re.compile(r"[.!?…][\"')\]]*$")
+# Last characters that may end a sentence, checked before the pattern
+SENTENCE_END_CHARS = ".!?…"
+CLOSING_CHARS = "\"')]"
+
+# Segments are compared lowercased, without surrounding punctuation, and their
+# words without any punctuation
+PUNCTUATION = string.punctuation + "…¿¡«»“”‘’"
+PUNCTUATION_TABLE = str.maketrans("", "", PUNCTUATION)
+
+# A segment that normalizes to one of the last few kept segments is dropped.
+# Shorter segments ("Yeah.") only when they repeat the previous one.
+DUPLICATE_WINDOW = 3
+DUPLICATE_MIN_WORDS = 4
+
+# Segments are nearly identical when their words overlap at least this much
+# (Jaccard similarity), and LOOP_MIN_RUN of them in a row are a loop
+LOOP_SIMILARITY = 0.8
+LOOP_MIN_RUN = 3
+
+# Merged sentences are cut at this length even without sentence punctuation
+MAX_SENTENCE_CHARS = 500
+
+# A phrase of up to MAX_LOOP_WORDS words, with the punctuation and space after
+# each word, repeated three or more times in a row, ignoring case
+MAX_LOOP_WORDS = 8
+LOOP_PATTERN = re.compile(rf"\b((?:\w+\W+){{1,{MAX_LOOP_WORDS}}}?)\1{{2,}}", re.IGNORECASE)
+
+
+def strip_timestamps(lines: Iterable[str]) -> Iterator[str]:
+    """Remove timestamps, null bytes and extra whitespace, skipping empty lines."""
+    for line in lines:
+        # Whisper puts the timestamp first, so only other tags need the regex
+        if line.startswith("["):
+            line = line[line.find("]") + 1 :]
+        if "[" in line:
+            line = TIMESTAMP_PATTERN.sub("", line)
+        line = line.strip()
+        # Most lines are single-spaced already
+        if "  " in line or not line.isprintable():
+            line = " ".join(line.replace("\x00", "").split())
+        if line:
+            yield line
+
+
+def normalize(segment: str) -> str:
+    return segment.lower().strip(PUNCTUATION)
+
+
+def nearly_identical(a: str, b: str) -> bool:
+    """Whether two normalized segments of about the same length share at least LOOP_SIMILARITY of their words."""
+    # Repeats start or end the same, which is cheaper to check than the words
+    if a.partition(" ")[0] != b.partition(" ")[0] and a.rpartition(" ")[2] != b.rpartition(" ")[2]:
+        return False
+    words_a, words_b = set(a.translate(PUNCTUATION_TABLE).split()), set(b.translate(PUNCTUATION_TABLE).split())
+    shared = len(words_a & words_b)
+    return shared >= LOOP_SIMILARITY * (len(words_a) + len(words_b) - shared)
+
+
+def drop_repeats(segments: Iterable[str]) -> Iterator[str]:
+    """Skip exact repeats of recent segments and collapse runs of nearly identical ones."""
+    recent: deque[str] = deque(maxlen=DUPLICATE_WINDOW)
+    # Segments nearly identical to run[0], held until it is known whether they loop
+    run: list[str] = []
+    run_key = ""
+    # Lengths of segments about as long as run_key, the cheapest check for repeats
+    shortest = longest = 0.0
+
+    for segment in segments:
+        key = normalize(segment)
+        if key and recent:
+            if key == recent[-1] or (key in recent and key.count(" ") + 1 >= DUPLICATE_MIN_WORDS):
+                continue
+        if run and key and shortest <= len(key) <= longest and nearly_identical(key, run_key):
+            run.append(segment)
+            recent.append(key)
+            continue
+
+        yield from run[:1] if len(run) >= LOOP_MIN_RUN else run
+        run, run_key = [segment], key
+        shortest, longest = LOOP_SIMILARITY * len(key), len(key) / LOOP_SIMILARITY
+        recent.append(key)
+
+    yield from run[:1] if len(run) >= LOOP_MIN_RUN else run
+
+
+def merge_fragments(segments: Iterable[str]) -> Iterator[str]:
+    """Join segments into whole sentences, one per line."""
+    parts: list[str] = []
+    length = 0
+
+    for segment in segments:
+        parts.append(segment)
+        length += len(segment) + 1
+        last = segment[-1]
+        if (
+            last in SENTENCE_END_CHARS
+            or (last in CLOSING_CHARS and SENTENCE_END_PATTERN.search(segment))
+            or length >= MAX_SENTENCE_CHARS
+        ):
+            yield " ".join(parts)
+            parts, length = [], 0
+
+    if parts:
+        yield " ".join(parts)
+
+
+def may_loop(words: list[str]) -> bool:
+    """Cheap check whether a word recurs at the same spacing, as it does in a loop."""
+    # A loop repeats at least two words, and a pair of words in a row. Sets
+    # rule out most sentences before the slower scan below.
+    if len(words) - len(set(words)) < 2 or len(set(zip(words, words[1:]))) == len(words) - 1:
+        return False
+    # Last position of each word, and the distance to the one before
+    seen: dict[str, tuple[int, int]] = {}
+    for i, word in enumerate(words):
+        last = seen.get(word)
+        if last is None:
+            seen[word] = (i, 0)
+            continue
+        if i - last[0] == last[1]:
+            return True
+        seen[word] = (i, i - last[0] if i - last[0] <= MAX_LOOP_WORDS else 0)
+    return False
+
+
+def collapse_loops(sentence: str) -> str:
+    """Keep a single copy of phrases repeated three or more times in a row."""
+    # Copies of a phrase split into the same words, wherever the spaces fall
+    if not may_loop(sentence.lower().split()):
+        return sentence
+    # The trailing space lets a loop at the very end match its last copy
+    return LOOP_PATTERN.sub(r"\1", sentence + " ").rstrip()
+
+
+def clean_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Clean whisper output line by line, yielding one sentence per line."""
+    segments = drop_repeats(strip_timestamps(lines))
+    for sentence in merge_fragments(segments):
+        yield collapse_loops(sentence)
+
+
+def clean_transcript(transcript: str) -> str:
+    return "\n".join(clean_lines(transcript.splitlines()))
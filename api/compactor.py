@@ -0,0 +1,109 @@
+"""Shrink long transcripts to a token budget before they are summarized.
+
+Transcripts within the budget are left alone. Longer ones first lose filler
+words and disfluencies. If that is not enough, the most informative sentences
+are kept, scored by how often their words occur across the whole transcript.
+The budget is shared out over consecutive sections of the transcript, so the
+whole video stays covered.
+"""
+
+import re
+from collections import Counter
+
+from tokens import count_tokens
+
+# Hesitations ("um", "uhh", "hmm") with the punctuation after them
+FILLER_PATTERN = re.compile(r"\b(?:u+h*m+|u+h+|e+r+m+|a+h+|h+m+|m+h*m+)\b[,.]?\s*", re.IGNORECASE)
+# Set-off hedges, e.g. "it was, you know, fine"
+HEDGE_PATTERN = re.compile(r"(?:,\s*)?\b(?:you know|I mean|sort of|kind of)\b,\s*", re.IGNORECASE)
+# A word said twice in a row, e.g. "I I think"
+STUTTER_PATTERN = re.compile(r"\b(\w+)(?:\s+\1\b)+", re.IGNORECASE)
+SPACES_PATTERN = re.compile(r" {2,}")
+WORD_PATTERN = re.compile(r"\w+")
+
+# Words too common to say what a sentence is about
+STOPWORDS = frozenset(
+    "about after again also because been before being could does doing down during from have having here "
+    "into just like more most much only other over really some such than that their them then there these "
+    "they this those through very want well were what when where which while will with would your yeah".split()
+)
+
+# The budget is spread over this many consecutive sections
+SECTIONS = 10
+# Marks where sentences were left out
+GAP_MARKER = "[...]"
+
+
+def remove_fillers(transcript: str) -> str:
+    text = FILLER_PATTERN.sub("", transcript)
+    text = HEDGE_PATTERN.sub(" ", text)
+    text = STUTTER_PATTERN.sub(r"\1", text)
+    return SPACES_PATTERN.sub(" ", text)
+
+
+def content_words(sentence: str) -> list[str]:
+    return [word for word in WORD_PATTERN.findall(sentence.lower()) if len(word) > 3 and word not in STOPWORDS]
+
+
+def select_sentences(sentences: list[str], budget: int) -> list[str]:
+    """Keep the highest scoring sentences within budget tokens, in their original order.
+
+    Args:
+        sentences: Transcript lines.
+        budget: Token budget for the kept sentences.
+
+    Returns:
+        list[str]: Kept sentences, with GAP_MARKER wherever sentences were left out.
+
+    """
+    words = [content_words(sentence) for sentence in sentences]
+    frequency = Counter(word for sentence_words in words for word in set(sentence_words))
+    tokens = [count_tokens(sentence) for sentence in sentences]
+    # Sentences about the transcript's recurring topics score high, short
+    # asides and small talk low
+    scores = [sum(frequency[word] for word in set(w)) / (len(w) or 1) for w in words]
+
+    total = sum(tokens)
+    section_size = max(1, len(sentences) // SECTIONS)
+    keep = set()
+    # Budget a section couldn't use goes to the next one
+    carried = 0.0
+    for start in range(0, len(sentences), section_size):
+        section = range(start, min(start + section_size, len(sentences)))
+        section_budget = budget * sum(tokens[i] for i in section) / total + carried
+        for i in sorted(section, key=lambda i: scores[i], reverse=True):
+            if tokens[i] <= section_budget:
+                keep.add(i)
+                section_budget -= tokens[i]
+        carried = section_budget
+
+    selected = []
+    for i, sentence in enumerate(sentences):
+        if i in keep:
+            selected.append(sentence)
+        elif not selected or selected[-1] != GAP_MARKER:
+            selected.append(GAP_MARKER)
+    return selected
+
+
+def compact_transcript(transcript: str, budget: int) -> str:
+    """Shrink a cleaned transcript to about budget tokens.
+
+    Args:
+        transcript: Cleaned transcript, one sentence per line.
+        budget: Token budget; 0 disables compaction.
+
+    Returns:
+        str: The transcript, compacted if it was over budget.
+
+    """
+    if not budget or count_tokens(transcript) <= budget:
+        return transcript
+
+    text = remove_fillers(transcript)
+    if count_tokens(text) <= budget:
+        return text
+
+    # Leave room for the gap markers
+    sentences = [line for line in text.splitlines() if line.strip()]
+    return "\n".join(select_sentences(sentences, int(budget * 0.95)))
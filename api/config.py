@@ -1,6 +1,7 @@
 """Centralized configuration for the summarize API."""
 
 import os
+import socket
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -17,25 +18,73 @@ for var in REQUIRED_ENV_VARS:
 # API Configuration
 API_PORT = int(os.getenv("API_PORT", "3669"))
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
+SSE_KEEPALIVE_INTERVAL = int(os.getenv("SSE_KEEPALIVE_INTERVAL", "15"))
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "1"))  # Seconds between database checks for changes to stream
 
 # Database
 DATABASE_PATH = Path(os.getenv("DATABASE_PATH", "summarize.db"))
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "wal")  # Use "delete" if the database is on a network filesystem
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))  # Seconds to wait for a lock before "database is locked"
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "64"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+TIMING_RETENTION = int(os.getenv("TIMING_RETENTION", "86400"))  # Seconds to keep each stage timing before it is rolled into totals
 
 # File Storage
 TEMP_DIR = Path(os.getenv("TEMP_DIR", "temp"))
 TEMP_DIR.mkdir(parents=True, exist_ok=True)
+TEMP_MAX_BYTES = int(os.getenv("TEMP_MAX_BYTES", "0"))  # Downloads wait while TEMP_DIR would go over this, 0 = no limit
+TEMP_RETENTION = int(os.getenv("TEMP_RETENTION", "0"))  # Seconds to keep intermediate files after use, for debugging
+
+# Cache of transcripts and summaries, reused when the same video or audio comes back
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 0 disables the cache
+
+# Playlist imports insert this many entries per transaction
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
 
 # Processing
-POLLING_INTERVAL = int(os.getenv("POLLING_INTERVAL", "5"))
+POLLING_INTERVAL = int(os.getenv("POLLING_INTERVAL", "60"))  # Backstop poll; new entries wake the daemon directly
+WAKEUP_HOST = os.getenv("WAKEUP_HOST", "127.0.0.1")
+WAKEUP_PORT = int(os.getenv("WAKEUP_PORT", "3670"))
+
+# Pipeline: worker threads per stage, and how many entries may wait between stages
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "2"))
+CONVERT_WORKERS = int(os.getenv("CONVERT_WORKERS", "2"))
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "1"))  # Each whisper run already uses WHISPER_THREADS
+SUMMARIZE_WORKERS = int(os.getenv("SUMMARIZE_WORKERS", "4"))  # Entries summarized at once, on one async worker
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", "2"))
+
+# Scheduling: higher priority entries go first; within a priority, submitters and
+# playlists take turns so a big import can't starve everyone else
+INTERACTIVE_PRIORITY = int(os.getenv("INTERACTIVE_PRIORITY", "10"))  # For POST /entries with "interactive": true
+SCHEDULE_SHORTEST_FIRST = os.getenv("SCHEDULE_SHORTEST_FIRST", "false").lower() == "true"  # By known duration
+
+# Downloads: retried with exponential backoff, and spaced out per host
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "4"))
+DOWNLOAD_BACKOFF_BASE = float(os.getenv("DOWNLOAD_BACKOFF_BASE", "5"))  # Seconds before the first retry, doubling after
+DOWNLOAD_HOST_INTERVAL = float(os.getenv("DOWNLOAD_HOST_INTERVAL", "2"))  # Minimum seconds between requests to one host
+DOWNLOAD_CONCURRENT_FRAGMENTS = int(os.getenv("DOWNLOAD_CONCURRENT_FRAGMENTS", "4"))  # For fragmented (DASH/HLS) streams
+DOWNLOAD_RATE_LIMIT = int(os.getenv("DOWNLOAD_RATE_LIMIT", "0"))  # Bytes per second per download, 0 = unlimited
+
+# Workers: each daemon claims entries with a lease and renews it while working,
+# so several daemons (on one host or many) can share the same database
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+LEASE_DURATION = int(os.getenv("LEASE_DURATION", "300"))  # Seconds before an unrenewed claim can be taken over
+HEARTBEAT_INTERVAL = int(os.getenv("HEARTBEAT_INTERVAL", "60"))
 
 # Audio Settings
 AUDIO_SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", "16000"))
-MP3_QUALITY = os.getenv("MP3_QUALITY", "192")
+# Pipe decoded audio from ffmpeg straight into whisper-cli instead of writing a WAV
+# file first. Only used with the cli backend and without chunking, which need a WAV.
+AUDIO_STREAMING = os.getenv("AUDIO_STREAMING", "true").lower() == "true"
 
 # Whisper Configuration
 WHISPER_BASE_DIR = Path(os.getenv("WHISPER_BASE_DIR", "whisper.cpp"))
 WHISPER_BINARY = WHISPER_BASE_DIR / "build/bin/whisper-cli"
 WHISPER_MODEL = WHISPER_BASE_DIR / "models/ggml-large-v3-turbo.bin"
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "cli")  # "cli" runs whisper-cli per file, "server" keeps the model loaded
+WHISPER_SERVER_BINARY = WHISPER_BASE_DIR / "build/bin/whisper-server"
+WHISPER_SERVER_PORT = int(os.getenv("WHISPER_SERVER_PORT", "8178"))
+WHISPER_SERVER_STARTUP_TIMEOUT = int(os.getenv("WHISPER_SERVER_STARTUP_TIMEOUT", "120"))
 WHISPER_THREADS = int(os.getenv("WHISPER_THREADS", "8"))  # Half of available cores for balance
 WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE", "en")  # Avoid auto-detection overhead
 WHISPER_ENTROPY_THRESHOLD = float(os.getenv("WHISPER_ENTROPY_THRESHOLD", "2.4"))  # Default is better for quality
@@ -43,9 +92,41 @@ WHISPER_BEAM_SIZE = int(os.getenv("WHISPER_BEAM_SIZE", "5"))
 WHISPER_MAX_CONTEXT = int(os.getenv("WHISPER_MAX_CONTEXT", "-1"))  # -1 = unlimited for best quality
 WHISPER_SUPPRESS_NON_SPEECH = os.getenv("WHISPER_SUPPRESS_NON_SPEECH", "true").lower() == "true"  # Filter out non-speech tokens
 
+# Chunked transcription: split long audio at silences and transcribe the chunks in
+# parallel, each whisper process getting WHISPER_THREADS / WHISPER_PARALLEL_CHUNKS threads
+WHISPER_CHUNK_SECONDS = int(os.getenv("WHISPER_CHUNK_SECONDS", "0"))  # 0 = transcribe in one pass
+WHISPER_PARALLEL_CHUNKS = int(os.getenv("WHISPER_PARALLEL_CHUNKS", "4"))
+VAD_SILENCE_DB = float(os.getenv("VAD_SILENCE_DB", "-40"))  # RMS level below which a frame is silent
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "300"))
+VAD_FRAME_MS = int(os.getenv("VAD_FRAME_MS", "30"))
+# Checkpoints: audio longer than this is transcribed in windows of about this many
+# seconds (cut at silences), each saved when done, so a crash loses at most one
+# window. Chunks are checkpointed too. Off by default: such audio is converted to
+# WAV even with AUDIO_STREAMING, and the cli backend loads the model once per window.
+WHISPER_CHECKPOINT_SECONDS = int(os.getenv("WHISPER_CHECKPOINT_SECONDS", "0"))  # 0 = no checkpoints
+
 # LLM Configuration
 LLM_API_KEY = os.getenv("OPENROUTER_API_KEY")
 LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1")
 LLM_MODEL = os.getenv("LLM_MODEL", "openai/gpt-5-nano")
 LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
 LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "16384"))
+
+# LLM requests: shared by all summaries, rate limited to the provider's limits
+# and retried with exponential backoff
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))  # Requests in flight at once, also the connection pool size
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))  # Requests per minute, 0 = unlimited
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))  # Tokens per minute (prompt and completion), 0 = unlimited
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))  # Seconds to wait for the next bytes of a response
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "2"))  # Seconds before the first retry, doubling after
+
+# Transcripts longer than this are summarized in chunks, then combined
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "32000"))
+# Transcripts longer than this are compacted (fillers removed, then the most
+# informative sentences kept) before summarization; 0 = never compact
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "60000"))
+# tiktoken encoding used to count tokens
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+# The summary is streamed and saved to the entry every this many tokens
+SUMMARY_FLUSH_TOKENS = int(os.getenv("SUMMARY_FLUSH_TOKENS", "100"))
@@ -1,122 +1,550 @@
-"""Daemon to process entries in the database."""
+"""Daemon to process entries in the database.
+
+Each processing stage (download, convert, transcribe, summarize) has its own
+pool of worker threads. Stages are connected by bounded queues, so one video
+can be transcribed while the next one downloads and a third one is summarized.
+Summaries mostly wait on the LLM provider, so they run as asyncio tasks on a
+single worker thread instead, SUMMARIZE_WORKERS at a time.
+"""
+import asyncio
+import itertools
+import queue
+import threading
 import time
-from datetime import datetime, timezone
-from pathlib import Path
 
 import structlog
 
-from config import POLLING_INTERVAL, TEMP_DIR
-from downloader import convert_to_wav, download_audio, fetch_video_title, get_audio_filepath
+import cache
+from cleaner import clean_transcript
+from compactor import compact_transcript
+from config import (
+    CONVERT_WORKERS,
+    DOWNLOAD_WORKERS,
+    HEARTBEAT_INTERVAL,
+    POLLING_INTERVAL,
+    STAGE_QUEUE_SIZE,
+    SUMMARIZE_WORKERS,
+    SUMMARY_TOKEN_BUDGET,
+    TEMP_DIR,
+    TIMING_RETENTION,
+    TRANSCRIBE_WORKERS,
+)
+from downloader import (
+    convert_to_wav,
+    download_audio,
+    extract_video_info,
+    find_downloaded_audio,
+    get_video_metadata,
+    probe_duration,
+)
 from helpers import get_transcript_path
-from model import Entry
+from leases import claim_entry, claimable_entries, holds_lease, lease_is_free, release_entry, renew_leases
+from metrics import roll_up_timings
+from model import Entry, clear_checkpoints, db, load_transcript, store_transcript
+from storage import entry_files, expected_entry_bytes, release, release_space, reserve_space, sweep
 from summarizer import summarize_transcript
-from transcriber import clean_transcript, transcribe_audio
+from timing import current_entry, span
+from tokens import count_tokens
+from transcriber import can_stream, transcribe_audio
+from wakeup import listen, notify, wait
 
 log = structlog.get_logger()
 
+# Number of entries each stage works on at once, keyed by the status it handles
+STAGE_WORKERS = {
+    "downloading": DOWNLOAD_WORKERS,
+    "converting": CONVERT_WORKERS,
+    "transcribing": TRANSCRIBE_WORKERS,
+    "summarizing": SUMMARIZE_WORKERS,
+}
+
+
+class StageQueue(queue.PriorityQueue):
+    """Bounded queue between stages that hands out the highest priority entry first.
+
+    Entries of equal priority come out in the order they were put in, so an
+    interactive entry overtakes queued bulk entries at every stage.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        super().__init__(maxsize)
+        self.counter = itertools.count()
+
+    # Called by put() and get() with the queue's lock held
+    def _put(self, entry: Entry) -> None:
+        super()._put((-entry.priority, next(self.counter), entry))
+
+    def _get(self) -> Entry:
+        return super()._get()[-1]
+
+
+stage_queues: dict[str, StageQueue] = {status: StageQueue(maxsize=STAGE_QUEUE_SIZE) for status in STAGE_WORKERS}
+
+# Ids of entries currently queued or being worked on by a stage
+in_flight: set[int] = set()
+in_flight_lock = threading.Lock()
+
 
 def resume_interrupted_entries() -> None:
+    """Clean up after entries whose worker died mid-stage.
+
+    Only entries without a live lease are touched; entries another daemon is
+    still working on are left alone. The expired leases themselves are taken
+    over by the regular claiming in dispatch_entries.
+    """
     interrupted_statuses = ["downloading", "converting", "transcribing", "summarizing"]
-    interrupted_entries = Entry.select().where(Entry.status.in_(interrupted_statuses))
+    interrupted_entries = Entry.select().where(
+        Entry.status.in_(interrupted_statuses), lease_is_free()
+    )
 
     for entry in interrupted_entries:
         log.info(f"Resuming interrupted entry: {entry.url} (was {entry.status})")
 
         if entry.status == "transcribing":
             # Always remove transcription file when resuming from transcribing state
-            # This ensures incomplete transcriptions are regenerated
+            # This ensures incomplete transcriptions are regenerated. Checkpointed
+            # windows are kept, so whisper resumes after the last one
             transcript_path = get_transcript_path(entry)
             if transcript_path.exists():
                 transcript_path.unlink()
                 log.info(f"Removed incomplete transcription: {transcript_path}")
-            entry.status = "transcribing"
 
+
+def store_metadata(entry: Entry, info: dict) -> None:
+    """Store the video's metadata, and its title in place of a URL.
+
+    Fields missing from info keep what was stored before, e.g. at playlist import.
+    """
+    metadata = get_video_metadata(info)
+    if entry.name == entry.url and metadata["title"]:
+        log.info(f"Retrieved video title: {metadata['title']}")
+        entry.name = metadata["title"]
+    for field in ("duration", "channel", "upload_date"):
+        if metadata[field] is not None:
+            setattr(entry, field, metadata[field])
+    entry.save()
+
+
+def download_stage(entry: Entry) -> None:
+    """Extract the video's metadata and download its audio."""
+    if entry.status == "not_started":
+        entry.status = "downloading"
         entry.save()
 
+    # Reuse the transcript if this video was transcribed before, under any URL
+    transcription = cache.get_video_transcript(entry.url)
+    if transcription:
+        # Nothing to download, but a video submitted by URL still needs its title
+        if entry.name == entry.url:
+            info = extract_video_info(entry.url)
+            if info:
+                store_metadata(entry, info)
+        store_transcript(entry.id, transcription)
+        # A partial summary left by an earlier attempt may be of another transcript
+        entry.summary = None
+        entry.status = "summarizing"
+        entry.save()
+        release(entry_files(entry))
+        release_space(entry)
+        return
 
-def process_entries() -> None:
-    resume_interrupted_entries()
+    # Extract once; the downloader reuses the same info
+    info = extract_video_info(entry.url)
+    if info:
+        store_metadata(entry, info)
+
+    # Wait for room under TEMP_MAX_BYTES for the audio, the WAV made from it and
+    # its chunks, kept until the files are released
+    audio_bytes = info and (info.get("filesize") or info.get("filesize_approx"))
+    reserve_space(entry, expected_entry_bytes(audio_bytes, entry.duration, convert=not can_stream(entry.duration)))
+    audio_path = download_audio(entry, info)
+    if not audio_path:
+        log.error(f"Download failed for {entry.url}")
+        entry.status = "error"
+        entry.save()
+        return
+
+    # Estimate again from the actual file, before the WAV is written
+    if entry.duration is None:
+        duration = probe_duration(audio_path)
+        if duration is not None:
+            entry.duration = round(duration)
+    reserve_space(
+        entry,
+        expected_entry_bytes(audio_path.stat().st_size, entry.duration, convert=not can_stream(entry.duration)),
+    )
+
+    # Hashed now, so the audio can be deleted once it is converted
+    entry.audio_key = cache.audio_transcript_key(audio_path)
+    entry.status = "converting"
+    entry.save()
+
+
+def convert_stage(entry: Entry) -> None:
+    """Convert the downloaded audio to the WAV format whisper.cpp expects.
+
+    Skipped when the audio is streamed to whisper during transcription instead.
+    """
+    if can_stream(entry.duration):
+        audio_path = find_downloaded_audio(entry)
+    else:
+        audio_path = convert_to_wav(entry)
+        downloaded_path = find_downloaded_audio(entry)
+        if audio_path and downloaded_path and entry.audio_key:
+            # Transcription only needs the WAV, and the cache key is known
+            release([downloaded_path])
+    if not audio_path:
+        log.error(f"Conversion failed for {entry.url}")
+        entry.status = "error"
+        entry.save()
+        return
+
+    entry.status = "transcribing"
+    entry.save()
+
+
+def transcribe_stage(entry: Entry) -> None:
+    """Transcribe the audio with whisper.cpp and store the cleaned transcript."""
+    audio_path = find_downloaded_audio(entry) if can_stream(entry.duration) else convert_to_wav(entry)
+    if not audio_path:
+        log.error(f"No audio to transcribe for {entry.url}")
+        entry.status = "error"
+        entry.save()
+        return
+
+    # Remove any existing transcript file to ensure fresh transcription
+    # This handles cases where transcription was interrupted
+    transcript_path = get_transcript_path(entry)
+    if transcript_path.exists():
+        transcript_path.unlink()
+        log.info(f"Removed existing transcript file: {transcript_path}")
+
+    audio_key = entry.audio_key or cache.audio_transcript_key(find_downloaded_audio(entry) or audio_path)
+    transcription = cache.get(audio_key)
+    if not transcription:
+        transcription = transcribe_audio(audio_path, transcript_path, entry.id)
+        if not transcription:
+            log.error(f"Transcription failed for {audio_path}")
+            entry.status = "error"
+            entry.save()
+            return
+
+        log.info("Cleaning transcript...")
+        transcription = clean_transcript(transcription)
+        cache.put(audio_key, transcription)
+
+    cache.link_video_transcript(entry.url, audio_key)
+    store_transcript(entry.id, transcription)
+    # A partial summary left by an earlier attempt may be of another transcript
+    entry.summary = None
+    entry.status = "summarizing"
+    entry.save()
+    # The transcript is stored, so the audio, WAV, whisper output and checkpoints can go
+    release(entry_files(entry))
+    release_space(entry)
+    clear_checkpoints(entry.id)
+
+
+async def summarize_stage(entry: Entry) -> None:
+    """Summarize the transcript with the LLM."""
+    transcription = load_transcript(entry.id)
+    if not transcription:
+        log.error(f"No transcript to summarize for {entry.url}")
+        entry.status = "error"
+        entry.save()
+        return
+
+    key = cache.summary_key(transcription)
+    summary = cache.get(key)
+    if not summary:
+        log.info("Generating summary...")
+
+        def save_progress(text: str) -> None:
+            # Lets clients read the summary while it is written
+            entry.summary = text
+            entry.save()
+
+        prompt_transcript = compact_transcript(transcription, SUMMARY_TOKEN_BUDGET)
+        entry.transcript_tokens = count_tokens(transcription)
+        entry.prompt_tokens = count_tokens(prompt_transcript)
+        entry.save()
+        if entry.prompt_tokens < entry.transcript_tokens:
+            log.info(f"Compacted transcript from {entry.transcript_tokens} to {entry.prompt_tokens} tokens")
+
+        # Until the entry is done, its summary is what an interrupted attempt
+        # got to. It is regenerated from scratch, and shown until the new one
+        # is longer.
+        summary = await summarize_transcript(prompt_transcript, entry.summary, save_progress)
+        if not summary:
+            # Never cached, so the next attempt asks again
+            log.error(f"Empty summary for {entry.url}")
+            entry.status = "error"
+            entry.save()
+            return
+        cache.put(key, summary)
+    entry.summary = summary
+    entry.status = "done"
+    entry.save()
+    log.info(f"Completed: {entry.name}")
+
+
+STAGE_HANDLERS = {
+    "downloading": download_stage,
+    "converting": convert_stage,
+    "transcribing": transcribe_stage,
+    "summarizing": summarize_stage,
+}
+
+
+def get_stage(status: str) -> str | None:
+    """Return the stage that handles entries with the given status."""
+    if status == "not_started":
+        return "downloading"
+    return status if status in STAGE_HANDLERS else None
+
+
+def finish_job(entry: Entry) -> str | None:
+    """Return the stage an entry goes to next, releasing it if there is none.
+
+    Returns:
+        str | None: Next stage, or None if the entry is finished or another
+            worker took it over.
+
+    """
+    next_stage = get_stage(entry.status)
+    if next_stage and not holds_lease(entry):
+        log.warning(f"Lost lease on entry {entry.id}, another worker took it over")
+        return None
+    if not next_stage:
+        release_entry(entry)
+    return next_stage
+
+
+def fail_entry(entry: Entry) -> None:
+    """Mark an entry whose stage raised as failed."""
+    entry.status = "error"
+    try:
+        entry.save()
+    except Exception as e:
+        # Its lease expires once it is no longer renewed, and the stage is retried
+        log.exception(f"Error saving failed entry {entry.id}: {e}")
+
+
+def forget(entry: Entry) -> None:
+    """Stop working on an entry, so its lease is no longer renewed."""
+    with in_flight_lock:
+        in_flight.discard(entry.id)
+    # Files a failed entry left behind count as they are, until sweep() deletes them
+    release_space(entry)
+
+
+def hand_off(entry: Entry, next_stage: str | None) -> None:
+    """Queue an entry for its next stage, or forget it when it has none.
+
+    Never raises: an entry left in in_flight would keep its lease forever.
+    """
+    try:
+        if next_stage:
+            # Blocks while the next stage is saturated, which throttles this stage
+            stage_queues[next_stage].put(entry)
+            return
+    except Exception as e:
+        log.exception(f"Error queueing entry {entry.id} for {next_stage}: {e}")
+    forget(entry)
+
+
+def stage_worker(stage: str) -> None:
+    """Run entries through one stage, then hand them to the next stage's queue.
+
+    Args:
+        stage: Status handled by this worker, e.g. "transcribing".
+
+    """
+    handler = STAGE_HANDLERS[stage]
+    inbox = stage_queues[stage]
+
+    while True:
+        entry = inbox.get()
+        # A slot just opened up in this stage's queue
+        notify()
+
+        # Hold a connection only for the job, not while waiting on the queues.
+        # Nothing may escape: it would end this worker thread.
+        next_stage = None
+        try:
+            with db.connection_context():
+                current_entry.set(entry.id)
+                try:
+                    log.info(f"Processing ({stage}): {entry.url}")
+                    with span(stage) as stats:
+                        handler(entry)
+                        stats["audio_seconds"] = entry.duration
+                        stats["success"] = entry.status != "error"
+                except Exception as e:
+                    log.exception(f"Error processing entry {entry.id}: {e}")
+                    fail_entry(entry)
+                next_stage = finish_job(entry)
+        except Exception as e:
+            log.exception(f"Error finishing entry {entry.id}: {e}")
+
+        hand_off(entry, next_stage)
+
+
+async def summarize_job(entry: Entry, slots: asyncio.Semaphore) -> None:
+    # Each job is its own task, so this doesn't leak into other jobs
+    current_entry.set(entry.id)
+    try:
+        log.info(f"Processing (summarizing): {entry.url}")
+        with span("summarizing") as stats:
+            await summarize_stage(entry)
+            stats["audio_seconds"] = entry.duration
+            stats["success"] = entry.status != "error"
+    except Exception as e:
+        log.exception(f"Error processing entry {entry.id}: {e}")
+        fail_entry(entry)
+    finally:
+        slots.release()
+
+    next_stage = None
+    try:
+        next_stage = finish_job(entry)
+    except Exception as e:
+        log.exception(f"Error finishing entry {entry.id}: {e}")
+    # Summarizing is the last stage, so this never waits on a queue
+    hand_off(entry, next_stage)
+
+
+async def summarize_worker() -> None:
+    """Summarize up to SUMMARIZE_WORKERS entries at once on this thread's event loop."""
+    loop = asyncio.get_running_loop()
+    inbox = stage_queues["summarizing"]
+    slots = asyncio.Semaphore(SUMMARIZE_WORKERS)
+    entries: asyncio.Queue[Entry] = asyncio.Queue()
+    jobs: set[asyncio.Task] = set()
+
+    def feed() -> None:
+        while True:
+            # Leave entries in the stage queue until a slot is free, so the
+            # dispatcher sees the stage is saturated
+            asyncio.run_coroutine_threadsafe(slots.acquire(), loop).result()
+            entry = inbox.get()
+            notify()
+            loop.call_soon_threadsafe(entries.put_nowait, entry)
+
+    # A daemon thread, unlike asyncio.to_thread, doesn't keep the process alive
+    threading.Thread(target=feed, name="summarizing-feed", daemon=True).start()
+
+    # All jobs run on this thread and share its connection. Their database
+    # calls are short and never span an await, so they don't interleave.
+    db.connect(reuse_if_open=True)
 
     while True:
-        entry = (
-            Entry.select()
-            .where(Entry.status.not_in(["done", "error"]))
-            .order_by(Entry.insertion_date.asc())
-            .first()
-        )
-
-        if entry:
+        entry = await entries.get()
+        job = asyncio.create_task(summarize_job(entry, slots))
+        # Keep a reference until the job is done, or it may be garbage collected
+        jobs.add(job)
+        job.add_done_callback(jobs.discard)
+
+
+def dispatch_entries() -> int:
+    """Claim pending entries and queue them for their current stage.
+
+    Returns:
+        Number of entries claimed.
+
+    """
+    claimed = 0
+    # Read all candidates first: claiming writes on this connection, and a write
+    # while a SELECT is still being read fails with "database is locked" as soon
+    # as another connection has written in between (SQLite WAL snapshots)
+    for entry in list(claimable_entries()):
+        if all(stage_queue.full() for stage_queue in stage_queues.values()):
+            break
+
+        stage = get_stage(entry.status)
+        if not stage:
+            log.warning(f"Entry {entry.id} has unknown status {entry.status}")
+            continue
+        if stage_queues[stage].full() or not claim_entry(entry):
+            continue
+
+        with in_flight_lock:
             try:
-                log.info(f"Processing: {entry.url}")
-
-                # Fetch and update video title if needed
-                if entry.name == entry.url:
-                    video_title = fetch_video_title(entry.url)
-                    if video_title:
-                        log.info(f"Retrieved video title: {video_title}")
-                        entry.name = video_title
-                        entry.save()
-
-                # Download phase
-                if entry.status == "not_started":
-                    entry.status = "downloading"
-                    entry.save()
-
-                if entry.status == "downloading":
-                    audio_path = download_audio(entry)
-                    if not audio_path:
-                        log.error(f"Download failed for {entry.url}")
-                        entry.status = "error"
-                        entry.save()
-                        continue
-                    entry.status = "converting"
-                    entry.save()
-
-                # Convert phase
-                if entry.status == "converting":
-                    audio_path = convert_to_wav(entry)
-                    entry.status = "transcribing"
-                    entry.save()
-
-                # Transcribe phase
-                if entry.status == "transcribing":
-                    audio_path = convert_to_wav(entry)
-
-                    # Remove any existing transcript file to ensure fresh transcription
-                    # This handles cases where transcription was interrupted
-                    transcript_path = get_transcript_path(entry)
-                    if transcript_path.exists():
-                        transcript_path.unlink()
-                        log.info(f"Removed existing transcript file: {transcript_path}")
-
-                    transcription = transcribe_audio(audio_path)
-                    if not transcription:
-                        log.error(f"Transcription failed for {audio_path}")
-                        entry.status = "error"
-                        entry.save()
-                        continue
-
-                    log.info("Cleaning transcript...")
-                    transcription = clean_transcript(transcription)
-                    entry.transcription = transcription
-                    entry.save()
-                    entry.status = "summarizing"
-                    entry.save()
-
-                # Summarize phase
-                if entry.status == "summarizing":
-                    log.info("Generating summary...")
-                    summary = summarize_transcript(entry.transcription)
-                    entry.summary = summary
-                    entry.status = "done"
-                    entry.save()
-                    log.info(f"Completed: {entry.name}")
-            except Exception as e:
-                log.exception(f"Error processing entry {entry.id}: {e}")
-                entry.status = "error"
-                entry.save()
-
-        time.sleep(POLLING_INTERVAL)
+                stage_queues[stage].put_nowait(entry)
+            except queue.Full:
+                release_entry(entry)
+                continue
+            in_flight.add(entry.id)
+        claimed += 1
+
+    return claimed
+
+
+def heartbeat() -> None:
+    """Keep renewing the leases on entries this daemon is working on, and clean up TEMP_DIR and old timings."""
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        with in_flight_lock:
+            entry_ids = list(in_flight)
+        try:
+            with db.connection_context():
+                renew_leases(entry_ids)
+        except Exception as e:
+            log.exception(f"Error renewing leases: {e}")
+        try:
+            # Files of failed entries, and kept ones once TEMP_RETENTION is up
+            with db.connection_context():
+                sweep()
+        except Exception as e:
+            log.exception(f"Error cleaning up {TEMP_DIR}: {e}")
+        try:
+            # Keeps the table /metrics aggregates small
+            with db.connection_context():
+                roll_up_timings(TIMING_RETENTION)
+        except Exception as e:
+            log.exception(f"Error rolling up stage timings: {e}")
+
+
+def start_stage_workers() -> None:
+    for stage, workers in STAGE_WORKERS.items():
+        if stage == "summarizing":
+            threading.Thread(
+                target=asyncio.run,
+                args=(summarize_worker(),),
+                name="summarizing",
+                daemon=True,
+            ).start()
+            continue
+
+        for i in range(workers):
+            threading.Thread(
+                target=stage_worker,
+                args=(stage,),
+                name=f"{stage}-{i}",
+                daemon=True,
+            ).start()
+
+
+def process_entries() -> None:
+    with db.connection_context():
+        resume_interrupted_entries()
+        # Remove what crashed runs left behind
+        sweep()
+    start_stage_workers()
+    threading.Thread(target=heartbeat, name="heartbeat", daemon=True).start()
+    threading.Thread(target=listen, name="wakeup", daemon=True).start()
+
+    while True:
+        # Keep going while there is work we can take; otherwise sleep until an
+        # entry is added, a stage frees a slot, or the backstop poll expires
+        claimed = 0
+        try:
+            with db.connection_context():
+                claimed = dispatch_entries()
+        except Exception as e:
+            log.exception(f"Error dispatching entries: {e}")
+        if not claimed:
+            wait(POLLING_INTERVAL)
 
 
 if __name__ == "__main__":
@@ -1,102 +1,219 @@
 """Downloads audio from YouTube using yt-dlp and converts it to 16-bit WAV."""
 
+import random
+import re
 import subprocess
+import threading
+import time
 import traceback
+from collections.abc import Callable
+from datetime import datetime
 from pathlib import Path
+from urllib.parse import urlparse
 
 import structlog
 import yt_dlp
 
-from config import AUDIO_SAMPLE_RATE, MP3_QUALITY, TEMP_DIR
+from config import (
+    AUDIO_SAMPLE_RATE,
+    DOWNLOAD_BACKOFF_BASE,
+    DOWNLOAD_CONCURRENT_FRAGMENTS,
+    DOWNLOAD_HOST_INTERVAL,
+    DOWNLOAD_RATE_LIMIT,
+    DOWNLOAD_RETRIES,
+    TEMP_DIR,
+)
 from helpers import sanitize_filename
 from model import Entry
+from timing import span
 
 log = structlog.get_logger()
 
 
-def fetch_video_title(url: str) -> str | None:
-    """Extract the title of a YouTube video using yt-dlp.
+# Options shared by metadata extraction and downloads, so an info dict extracted
+# once can be handed to the downloading YoutubeDL as-is
+YDL_OPTIONS = {
+    "format": "bestaudio/best",
+    "quiet": True,
+    "noprogress": True,
+    "concurrent_fragment_downloads": DOWNLOAD_CONCURRENT_FRAGMENTS,
+    "ratelimit": DOWNLOAD_RATE_LIMIT or None,
+    "extractor_args": {
+        "youtube": {
+            "player_client": ["android", "web"],
+        }
+    },
+}
+
+# Errors worth retrying: throttling, server errors and network trouble. Anything
+# else (private or removed videos, unsupported URLs) fails right away.
+RATE_LIMITED_PATTERN = re.compile(r"HTTP Error 429|Too Many Requests", re.IGNORECASE)
+TRANSIENT_PATTERN = re.compile(
+    r"HTTP Error 5\d\d|timed out|Connection (reset|refused|aborted)|Temporary failure|IncompleteRead",
+    re.IGNORECASE,
+)
+
+
+class HostRateLimiter:
+    """Space out requests to the same host, shared by all download workers."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_slot: dict[str, float] = {}
+
+    def wait(self, url: str) -> None:
+        """Block until the next request to url's host is allowed, and reserve it."""
+        host = urlparse(url).hostname or ""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, 0))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def back_off(self, url: str, delay: float) -> None:
+        """Hold off all requests to url's host for delay seconds."""
+        host = urlparse(url).hostname or ""
+        with self.lock:
+            self.next_slot[host] = max(self.next_slot.get(host, 0), time.monotonic() + delay)
+
+
+host_limiter = HostRateLimiter(DOWNLOAD_HOST_INTERVAL)
+
+
+def with_retries(url: str, action: Callable[[], dict]) -> dict:
+    """Run a yt-dlp action against url, retrying throttled and transient failures.
+
+    Retries wait DOWNLOAD_BACKOFF_BASE seconds, doubling each time, with jitter.
+    A 429 also holds off every other worker's requests to the same host.
+
+    Raises:
+        yt_dlp.utils.DownloadError: If the action keeps failing or the error is permanent.
+
+    """
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        host_limiter.wait(url)
+        try:
+            return action()
+        except yt_dlp.utils.DownloadError as e:
+            rate_limited = bool(RATE_LIMITED_PATTERN.search(str(e)))
+            if attempt == DOWNLOAD_RETRIES or not (rate_limited or TRANSIENT_PATTERN.search(str(e))):
+                raise
+
+            delay = DOWNLOAD_BACKOFF_BASE * 2**attempt * random.uniform(0.5, 1.5)
+            if rate_limited:
+                host_limiter.back_off(url, delay)
+            log.warning(f"Retrying {url} in {delay:.1f}s (attempt {attempt + 1}/{DOWNLOAD_RETRIES}): {e}")
+            time.sleep(delay)
+
+    raise AssertionError("unreachable")
+
+
+def get_video_metadata(info: dict) -> dict:
+    """Pick the metadata stored on an entry out of a yt-dlp info dict.
+
+    Works with both full info dicts and the flat entries of a playlist.
+
+    Args:
+        info (dict): Info dict from yt-dlp.
+
+    Returns:
+        dict: title, duration (seconds), channel and upload_date, each None if unknown.
+
+    """
+    title = info.get("title")
+    duration = info.get("duration")
+    upload_date = info.get("upload_date")
+    return {
+        # Sanitize
+        "title": title.replace("/", "_") if title else None,
+        "duration": int(duration) if duration else None,
+        "channel": info.get("channel") or info.get("uploader"),
+        "upload_date": datetime.strptime(upload_date, "%Y%m%d").date() if upload_date else None,
+    }
+
+
+def extract_video_info(url: str) -> dict | None:
+    """Extract the info of a YouTube video using yt-dlp, without downloading it.
 
     Args:
         url (str): URL of the YouTube video.
 
     Returns:
-        str: Title of the video.
+        dict: yt-dlp info dict, which download_audio can reuse.
 
     """
     try:
-        ydl_opts = {
-            "quiet": True,
-            "noprogress": True,
-            "extract_flat": True,
-            "extractor_args": {
-                "youtube": {
-                    "player_client": ["android", "web"],
-                }
-            },
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
+        with span("extract_info"), yt_dlp.YoutubeDL(YDL_OPTIONS) as ydl:
+            info = with_retries(url, lambda: ydl.extract_info(url, download=False))
             if not info:
                 msg = "failed to extract_info from youtube"
                 raise Exception(msg)
-            title = info.get("title", "")
-
-            # Sanitize
-            return title.replace("/", "_")
+            return info
     except Exception as e:
-        log.exception(f"Error fetching title for {url}: {e}")
+        log.exception(f"Error extracting info for {url}: {e}")
         return None
 
 
-def get_audio_filepath(entry_id: int, name: str) -> Path:
-    """Generate a unique file path for the downloaded audio based on video title.
+def get_audio_stem(entry: Entry) -> Path:
+    """Return the path of the downloaded audio without its extension.
+
+    The extension depends on the audio stream yt-dlp picks (e.g. .webm, .m4a).
 
     Args:
-        entry_id (int): ID of the entry in the database.
-        name (str): Title of the video
+        entry (Entry): Entry object representing the video.
 
     Returns:
-        Path: File path for the downloaded audio.
+        Path: File path for the downloaded audio, minus the extension.
 
     """
-    sanitized_name = sanitize_filename(name)
-    return TEMP_DIR / f"{entry_id}_{sanitized_name}.mp3"
+    sanitized_name = sanitize_filename(entry.name)
+    return TEMP_DIR / f"{entry.id}_{sanitized_name}"
 
 
-def download_audio(entry: Entry) -> Path | None:
-    """Download audio using yt-dlp and returns the file path.
+def find_downloaded_audio(entry: Entry) -> Path | None:
+    """Find the audio file downloaded for an entry.
 
     Args:
-        entry (str): Entry object representing the video.
+        entry (Entry): Entry object representing the video.
+
+    Returns:
+        Path: Path of the downloaded audio, or None if it's not there.
 
     """
-    output_path = get_audio_filepath(entry.id, entry.name)
+    stem = get_audio_stem(entry)
+    for path in stem.parent.glob(f"{stem.name}.*"):
+        if path.suffix not in {".wav", ".txt", ".part", ".ytdl"} and path.stat().st_size > 0:
+            return path
+    return None
+
+
+def download_audio(entry: Entry, info: dict | None = None) -> Path | None:
+    """Download the best audio stream as-is using yt-dlp and returns the file path.
+
+    The stream is not transcoded; ffmpeg decodes it once, straight to the
+    format whisper.cpp needs.
+
+    Args:
+        entry (str): Entry object representing the video.
+        info (dict): Info dict from extract_video_info. When given, the video
+            is not extracted a second time.
 
+    """
     # yt-dlp options
-    ydl_opts = {
-        "format": "bestaudio/best",
-        "outtmpl": str(output_path).rsplit(".", 1)[0],
-        "quiet": True,
-        "noprogress": True,
-        "extractor_args": {
-            "youtube": {
-                "player_client": ["android", "web"],
-            }
-        },
-        "postprocessors": [
-            {
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": MP3_QUALITY,
-            },
-        ],
-    }
+    ydl_opts = {**YDL_OPTIONS, "outtmpl": f"{get_audio_stem(entry)}.%(ext)s"}
 
     try:
         log.info(f"Downloading audio for: {entry.url}")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([entry.url])
+        with span("download") as stats, yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            if info:
+                info = with_retries(entry.url, lambda: ydl.process_ie_result(info, download=True))
+            else:
+                info = with_retries(entry.url, lambda: ydl.extract_info(entry.url, download=True))
+            output_path = Path(ydl.prepare_filename(info))
+            if output_path.exists():
+                stats["bytes"] = output_path.stat().st_size
     except yt_dlp.utils.DownloadError as e:
         log.exception(f"Error downloading {entry.url}: {e}")
         return None
@@ -129,10 +246,13 @@ def convert_to_wav(entry: Entry) -> Path | None:
         entry (Entry): Entry object representing the video.
 
     """
-    input_audio = get_audio_filepath(entry.id, entry.name)
+    input_audio = find_downloaded_audio(entry)
     output_audio = TEMP_DIR / f"{entry.id}_{entry.name}.wav"
 
     if not Path.exists(output_audio):
+        if not input_audio:
+            log.error(f"No downloaded audio found for {entry.url}")
+            return None
         log.debug(f"Converting {input_audio} to {AUDIO_SAMPLE_RATE}Hz WAV...")
         try:
             subprocess.run(
@@ -156,3 +276,35 @@ def convert_to_wav(entry: Entry) -> Path | None:
             return None
 
     return output_audio
+
+
+def probe_duration(audio_path: Path) -> float | None:
+    """Read the length of a downloaded audio file in seconds with ffprobe.
+
+    Args:
+        audio_path (Path): Audio file in any format ffmpeg reads.
+
+    Returns:
+        float | None: Duration, or None if ffprobe can't tell.
+
+    """
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-show_entries",
+                "format=duration",
+                "-of",
+                "default=noprint_wrappers=1:nokey=1",
+                str(audio_path),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        return float(result.stdout.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        log.warning(f"Could not read the duration of {audio_path}: {e}")
+        return None
@@ -0,0 +1,133 @@
+"""Entry changes, streamed to clients as server-sent events.
+
+The daemon may run in another process, or on another host, so changes are read
+from the database rather than published by Entry.save(). A single watcher
+thread per API process polls for entries whose updated_at moved every
+EVENTS_POLL_INTERVAL seconds, and hands a small delta per changed entry to
+each open /entries/events stream's subscription queue.
+"""
+
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import structlog
+from peewee import fn
+
+from config import EVENTS_POLL_INTERVAL
+from model import Entry, db
+
+log = structlog.get_logger()
+
+# Events a slow client may fall behind by before it starts missing some
+SUBSCRIPTION_SIZE = 1000
+
+# Writers set updated_at before they commit, so each poll also looks this many
+# seconds back for changes that were committed late
+LATE_COMMIT_WINDOW = 5
+
+# More changes than this in one poll, e.g. a playlist import, are sent as a
+# single event telling clients to reload
+REFRESH_THRESHOLD = 100
+
+_subscribers: set[queue.Queue] = set()
+_lock = threading.Lock()
+_watcher: threading.Thread | None = None
+
+
+def subscribe() -> queue.Queue:
+    global _watcher
+
+    subscription = queue.Queue(maxsize=SUBSCRIPTION_SIZE)
+    with _lock:
+        _subscribers.add(subscription)
+        if _watcher is None:
+            _watcher = threading.Thread(target=watch_entries, name="entry-events", daemon=True)
+            _watcher.start()
+    return subscription
+
+
+def unsubscribe(subscription: queue.Queue) -> None:
+    with _lock:
+        _subscribers.discard(subscription)
+
+
+def publish(event: dict) -> None:
+    """Send an event to every subscriber. Never blocks."""
+    with _lock:
+        subscribers = list(_subscribers)
+
+    for subscription in subscribers:
+        try:
+            subscription.put_nowait(event)
+        except queue.Full:
+            pass
+
+
+def publish_changes(last_seen: datetime, sent: dict[int, datetime]) -> tuple[datetime, dict[int, datetime]]:
+    """Publish the entries updated since last_seen.
+
+    Args:
+        last_seen: Latest updated_at of the previous poll.
+        sent: updated_at of the entries already published, within the late
+            commit window, so they are not sent twice.
+
+    Returns:
+        tuple: last_seen and sent for the next poll.
+
+    """
+    rows = list(
+        Entry.select(
+            Entry.id,
+            Entry.status,
+            Entry.name,
+            Entry.summary.is_null(False).alias("summary_available"),
+            Entry.updated_at,
+        )
+        .where(Entry.updated_at > last_seen - timedelta(seconds=LATE_COMMIT_WINDOW))
+        .order_by(Entry.updated_at)
+        .dicts()
+    )
+    changed = [row for row in rows if sent.get(row["id"]) != row["updated_at"]]
+
+    if len(changed) > REFRESH_THRESHOLD:
+        publish({"refresh": True})
+    else:
+        for row in changed:
+            publish(
+                {
+                    "id": row["id"],
+                    "status": row["status"],
+                    "name": row["name"],
+                    "summary_available": bool(row["summary_available"]),
+                }
+            )
+
+    if rows:
+        last_seen = max(last_seen, rows[-1]["updated_at"])
+    return last_seen, {row["id"]: row["updated_at"] for row in rows}
+
+
+def watch_entries() -> None:
+    """Publish entry changes while anyone is subscribed, for as long as the process runs."""
+    last_seen = None
+    sent: dict[int, datetime] = {}
+
+    while True:
+        time.sleep(EVENTS_POLL_INTERVAL)
+        with _lock:
+            watched = bool(_subscribers)
+        if not watched:
+            # Clients reload everything when they connect, so start afresh then
+            last_seen = None
+            continue
+
+        try:
+            with db.connection_context():
+                if last_seen is None:
+                    last_seen = Entry.select(fn.MAX(Entry.updated_at)).scalar() or datetime.now(timezone.utc)
+                    sent = {}
+                last_seen, sent = publish_changes(last_seen, sent)
+        except Exception as e:
+            log.exception(f"Error polling entry changes: {e}")
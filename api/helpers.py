@@ -8,6 +8,7 @@ from peewee import IntegrityError
 
 from config import TEMP_DIR
 from model import Entry
+from wakeup import notify
 
 log = structlog.get_logger()
 
@@ -25,11 +26,13 @@ def get_transcript_path(entry: Entry) -> Path:
     return TEMP_DIR / f"{entry.id}_{entry.name}.wav.txt"
 
 
-def create_or_reset_entry(url: str) -> tuple[Entry, bool]:
+def create_or_reset_entry(url: str, priority: int = 0, submitter: str | None = None) -> tuple[Entry, bool]:
     """Create a new entry or reset an existing error entry.
 
     Args:
         url: YouTube video URL.
+        priority: Scheduling priority, higher is processed first.
+        submitter: Who added the video, e.g. their IP address.
 
     Returns:
         tuple: (Entry object, is_new: bool)
@@ -43,17 +46,21 @@ def create_or_reset_entry(url: str) -> tuple[Entry, bool]:
             name=url,
             status="not_started",
             url=url,
-            transcription=None,
             insertion_date=datetime.now(timezone.utc),
+            priority=priority,
+            submitter=submitter,
         )
         log.info(f"Created new entry for {url}")
+        notify()
         return entry, True
     except IntegrityError:
         existing_entry = Entry.get(Entry.url == url)
         if existing_entry.status == "error":
             log.info(f"Resetting error video {url} to not_started")
             existing_entry.status = "not_started"
+            existing_entry.priority = priority
             existing_entry.save()
+            notify()
             return existing_entry, False
         else:
             log.warning(f"Entry with URL {url} already exists with status {existing_entry.status}")
@@ -0,0 +1,165 @@
+"""Background import of playlists and channels.
+
+Expanding a large playlist with yt-dlp takes a while, so POST /entries starts
+an import job and returns right away. The job inserts the videos in batches,
+each batch a single upsert in one transaction, and its progress can be
+followed at /imports/<job_id>.
+"""
+
+import threading
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+
+import structlog
+import yt_dlp
+
+from cache import YOUTUBE_ID_PATTERN
+from config import INGEST_BATCH_SIZE
+from downloader import get_video_metadata
+from model import Entry, db
+from wakeup import notify
+
+log = structlog.get_logger()
+
+# Finished jobs are forgotten once there are more than this many
+MAX_JOBS = 100
+
+jobs: dict[str, dict] = {}
+jobs_lock = threading.Lock()
+
+
+def is_single_video(url: str) -> bool:
+    """Whether a URL is a single YouTube video, which needs no expansion."""
+    return bool(YOUTUBE_ID_PATTERN.search(url)) and "list" not in parse_qs(urlparse(url).query)
+
+
+def get_job(job_id: str) -> dict | None:
+    with jobs_lock:
+        job = jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def update_job(job_id: str, **fields) -> None:
+    with jobs_lock:
+        jobs[job_id].update(fields)
+
+
+def start_import(url: str, priority: int = 0, submitter: str | None = None) -> str:
+    """Start importing a playlist, channel or other URL in the background.
+
+    Args:
+        url: URL to expand with yt-dlp.
+        priority: Scheduling priority of the imported entries.
+        submitter: Who started the import, e.g. their IP address.
+
+    Returns:
+        str: Id of the import job.
+
+    """
+    job_id = uuid.uuid4().hex
+    with jobs_lock:
+        finished = [key for key, job in jobs.items() if job["status"] != "running"]
+        for key in finished[: max(0, len(jobs) - MAX_JOBS + 1)]:
+            del jobs[key]
+        jobs[job_id] = {
+            "id": job_id,
+            "url": url,
+            "status": "running",
+            "total": None,
+            "processed": 0,
+            "error": None,
+        }
+
+    threading.Thread(
+        target=run_import,
+        args=(job_id, url, priority, submitter),
+        name=f"import-{job_id}",
+        daemon=True,
+    ).start()
+    return job_id
+
+
+def insert_videos(videos: list[dict], playlist: str | None, priority: int, submitter: str | None) -> None:
+    """Insert new entries for flat playlist entries in one transaction.
+
+    The title, duration and channel yt-dlp listed for each video are stored
+    right away. URLs already in the database are left alone, except entries
+    in error, which are reset so they are retried.
+
+    Args:
+        videos: Flat playlist entries from yt-dlp.
+        playlist: URL of the playlist or channel, None for a single video.
+        priority: Scheduling priority of the entries.
+        submitter: Who started the import.
+
+    """
+    now = datetime.now(timezone.utc)
+    rows = []
+    for video in videos:
+        metadata = get_video_metadata(video)
+        rows.append(
+            {
+                "name": metadata["title"] or video["url"],
+                "status": "not_started",
+                "url": video["url"],
+                "insertion_date": now,
+                "updated_at": now,
+                "duration": metadata["duration"],
+                "channel": metadata["channel"],
+                "upload_date": metadata["upload_date"],
+                "priority": priority,
+                "submitter": submitter,
+                "playlist": playlist,
+            }
+        )
+
+    with db.atomic():
+        (
+            Entry.insert_many(rows)
+            .on_conflict(
+                conflict_target=[Entry.url],
+                update={Entry.status: "not_started", Entry.updated_at: now},
+                where=(Entry.status == "error"),
+            )
+            .execute()
+        )
+
+
+def run_import(job_id: str, url: str, priority: int, submitter: str | None) -> None:
+    with db.connection_context():
+        import_videos(job_id, url, priority, submitter)
+
+
+def import_videos(job_id: str, url: str, priority: int, submitter: str | None) -> None:
+    try:
+        ydl_opts = {"quiet": True, "noprogress": True, "extract_flat": True}
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+        if not info:
+            msg = "failed to extract_info from youtube"
+            raise Exception(msg)
+
+        if info.get("entries") is not None:
+            videos = [entry for entry in info["entries"] if entry and entry.get("url")]
+            playlist = url
+            # Nobody waits on a whole playlist at once, so it is never interactive
+            priority = 0
+        else:
+            videos = [{**info, "url": info.get("webpage_url") or url}]
+            playlist = None
+
+        log.info(f"Importing {len(videos)} videos from {url}")
+        update_job(job_id, total=len(videos))
+
+        for start in range(0, len(videos), INGEST_BATCH_SIZE):
+            batch = videos[start : start + INGEST_BATCH_SIZE]
+            insert_videos(batch, playlist, priority, submitter)
+            update_job(job_id, processed=start + len(batch))
+            notify()
+
+        update_job(job_id, status="done")
+        log.info(f"Finished importing {url}")
+    except Exception as e:
+        log.exception(f"Error importing {url}: {e}")
+        update_job(job_id, status="error", error=str(e))
@@ -0,0 +1,110 @@
+"""Lease-based claiming of entries, so several daemons can share one database.
+
+A daemon owns an entry while its lease is valid. Claims and renewals are single
+conditional UPDATEs, so two workers can never hold the same entry. A lease that
+is not renewed (the worker crashed or hung) expires and the entry can be claimed
+by any worker.
+"""
+
+from collections.abc import Iterable
+from datetime import datetime, timedelta, timezone
+
+import structlog
+from peewee import SQL, fn
+
+from config import LEASE_DURATION, SCHEDULE_SHORTEST_FIRST, WORKER_ID
+from model import Entry
+
+log = structlog.get_logger()
+
+FINISHED_STATUSES = ["done", "error"]
+
+
+def lease_is_free():
+    """Peewee expression matching entries nobody holds a valid lease on."""
+    now = datetime.now(timezone.utc)
+    return Entry.lease_expires_at.is_null() | (Entry.lease_expires_at < now)
+
+
+def claimable_entries():
+    """Select unfinished entries that are not leased by a live worker, in the order to take them.
+
+    Higher priority entries come first. Within a priority, each submitter's
+    playlists and one-off videos take turns: every group's next entry comes
+    before any group's second, so a video added while a 500-video playlist is
+    being processed is next in line instead of last. Within a group, entries
+    go oldest first, or shortest first (by known duration) with
+    SCHEDULE_SHORTEST_FIRST.
+    """
+    job_order = [Entry.insertion_date.asc(), Entry.id.asc()]
+    if SCHEDULE_SHORTEST_FIRST:
+        job_order.insert(0, Entry.duration.asc(nulls="LAST"))
+    turn = fn.ROW_NUMBER().over(
+        partition_by=[Entry.priority, Entry.submitter, Entry.playlist],
+        order_by=job_order,
+    )
+    return (
+        Entry.select(Entry, turn.alias("turn"))
+        .where(Entry.status.not_in(FINISHED_STATUSES), lease_is_free())
+        .order_by(Entry.priority.desc(), SQL("turn"), *job_order)
+    )
+
+
+def claim_entry(entry: Entry) -> bool:
+    """Atomically take the lease on an entry.
+
+    Args:
+        entry: Entry to claim.
+
+    Returns:
+        True if this worker now holds the lease, False if another worker won.
+
+    """
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=LEASE_DURATION)
+    claimed = (
+        Entry.update(worker_id=WORKER_ID, lease_expires_at=expires_at)
+        .where(
+            Entry.id == entry.id,
+            Entry.status.not_in(FINISHED_STATUSES),
+            lease_is_free(),
+        )
+        .execute()
+    )
+    return bool(claimed)
+
+
+def renew_leases(entry_ids: Iterable[int]) -> int:
+    """Extend the leases this worker holds on the given entries.
+
+    Args:
+        entry_ids: Ids of entries this worker is processing.
+
+    Returns:
+        Number of leases renewed. Entries whose lease was taken over by another
+        worker after it expired are not renewed.
+
+    """
+    entry_ids = list(entry_ids)
+    if not entry_ids:
+        return 0
+
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=LEASE_DURATION)
+    return (
+        Entry.update(lease_expires_at=expires_at)
+        .where(Entry.id.in_(entry_ids), Entry.worker_id == WORKER_ID)
+        .execute()
+    )
+
+
+def holds_lease(entry: Entry) -> bool:
+    """Renew the lease on an entry, returning False if this worker lost it."""
+    return renew_leases([entry.id]) == 1
+
+
+def release_entry(entry: Entry) -> None:
+    """Give up this worker's lease on an entry."""
+    (
+        Entry.update(worker_id=None, lease_expires_at=None)
+        .where(Entry.id == entry.id, Entry.worker_id == WORKER_ID)
+        .execute()
+    )
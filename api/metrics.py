@@ -0,0 +1,176 @@
+"""Prometheus metrics, computed from the database.
+
+The daemon may run in another process than the API, so instead of keeping
+counters in memory, each scrape aggregates the StageTiming rows the daemon
+writes and counts entries per status. The daemon rolls timings older than
+TIMING_RETENTION into per-stage StageTotal rows, so the table a scrape
+aggregates stays small while the counters keep growing.
+"""
+
+import json
+from datetime import datetime, timedelta, timezone
+
+from peewee import Case, fn
+
+from model import CacheItem, Entry, StageTiming, StageTotal, db
+
+# Upper bounds of the duration histogram buckets, in seconds
+DURATION_BUCKETS = [0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+
+PREFIX = "summarize"
+
+# Sums kept per stage, besides the number of runs in each duration bucket
+TOTAL_FIELDS = ["count", "duration", "failures", "audio_seconds", "bytes", "prompt_tokens", "completion_tokens"]
+
+
+def escape_label(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float | None) -> str:
+    # Not :g, which rounds counters to 6 significant digits
+    if value is None:
+        return "0"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class MetricsWriter:
+    """Collect metrics as lines of the Prometheus text exposition format."""
+
+    def __init__(self) -> None:
+        self.lines: list[str] = []
+
+    def declare(self, name: str, kind: str, help_text: str) -> None:
+        self.lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        self.lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+    def sample(self, name: str, value: float | None, **labels: object) -> None:
+        pairs = ",".join(f'{label}="{escape_label(label_value)}"' for label, label_value in labels.items())
+        series = f"{PREFIX}_{name}{{{pairs}}}" if pairs else f"{PREFIX}_{name}"
+        self.lines.append(f"{series} {format_value(value)}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def aggregate_timings(*conditions) -> list[dict]:
+    """Sum up the StageTiming rows of each stage, counting runs per duration bucket."""
+    buckets = [
+        fn.SUM(Case(None, [(StageTiming.duration <= bound, 1)], 0)).alias(f"bucket_{i}")
+        for i, bound in enumerate(DURATION_BUCKETS)
+    ]
+    query = StageTiming.select(
+        StageTiming.stage,
+        fn.COUNT(StageTiming.id).alias("count"),
+        fn.SUM(StageTiming.duration).alias("duration"),
+        fn.SUM(Case(None, [(StageTiming.success == False, 1)], 0)).alias("failures"),  # noqa: E712
+        fn.SUM(StageTiming.audio_seconds).alias("audio_seconds"),
+        fn.SUM(StageTiming.bytes).alias("bytes"),
+        fn.SUM(StageTiming.prompt_tokens).alias("prompt_tokens"),
+        fn.SUM(StageTiming.completion_tokens).alias("completion_tokens"),
+        *buckets,
+    )
+    if conditions:
+        query = query.where(*conditions)
+    return list(query.group_by(StageTiming.stage).dicts())
+
+
+def add_totals(totals: dict, row: dict) -> None:
+    """Add the sums in row to totals; sums that are None in both stay None."""
+    for field in TOTAL_FIELDS + [f"bucket_{i}" for i in range(len(DURATION_BUCKETS))]:
+        if row.get(field) is not None:
+            totals[field] = (totals.get(field) or 0) + row[field]
+        else:
+            totals.setdefault(field, None)
+
+
+def load_totals(total: StageTotal) -> dict:
+    totals = {field: getattr(total, field) for field in TOTAL_FIELDS}
+    buckets = json.loads(total.buckets)
+    for i, bound in enumerate(DURATION_BUCKETS):
+        totals[f"bucket_{i}"] = buckets.get(f"{bound:g}", 0)
+    return totals
+
+
+def roll_up_timings(retention: int) -> int:
+    """Add StageTiming rows older than retention seconds to the StageTotal rows, and delete them.
+
+    Returns:
+        int: Number of timings rolled up.
+
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=retention)
+    # Immediate, so two daemons can't both roll up the same rows
+    with db.atomic("IMMEDIATE"):
+        for row in aggregate_timings(StageTiming.started_at < cutoff):
+            total = StageTotal.get_or_none(StageTotal.stage == row["stage"])
+            totals = load_totals(total) if total else {}
+            add_totals(totals, row)
+            buckets = {f"{bound:g}": totals.pop(f"bucket_{i}") or 0 for i, bound in enumerate(DURATION_BUCKETS)}
+            StageTotal.insert(stage=row["stage"], buckets=json.dumps(buckets), **totals).on_conflict_replace().execute()
+        return StageTiming.delete().where(StageTiming.started_at < cutoff).execute()
+
+
+def write_stage_metrics(writer: MetricsWriter) -> None:
+    stage_totals = {total.stage: load_totals(total) for total in StageTotal.select()}
+    for row in aggregate_timings():
+        add_totals(stage_totals.setdefault(row["stage"], {}), row)
+    stages = [{"stage": stage, **stage_totals[stage]} for stage in sorted(stage_totals)]
+
+    writer.declare(
+        "stage_duration_seconds",
+        "histogram",
+        "Time spent in each pipeline stage (downloading, ...) and step (download, whisper, llm_request, ...).",
+    )
+    for row in stages:
+        for i, bound in enumerate(DURATION_BUCKETS):
+            writer.sample("stage_duration_seconds_bucket", row[f"bucket_{i}"], stage=row["stage"], le=f"{bound:g}")
+        writer.sample("stage_duration_seconds_bucket", row["count"], stage=row["stage"], le="+Inf")
+        writer.sample("stage_duration_seconds_sum", row["duration"], stage=row["stage"])
+        writer.sample("stage_duration_seconds_count", row["count"], stage=row["stage"])
+
+    writer.declare("stage_failures_total", "counter", "Stage and step runs that failed.")
+    for row in stages:
+        writer.sample("stage_failures_total", row["failures"], stage=row["stage"])
+
+    writer.declare(
+        "stage_audio_seconds_total",
+        "counter",
+        "Seconds of audio handled by each stage or step; divide its duration by this for the real-time factor.",
+    )
+    for row in stages:
+        if row["audio_seconds"] is not None:
+            writer.sample("stage_audio_seconds_total", row["audio_seconds"], stage=row["stage"])
+
+    writer.declare("stage_bytes_total", "counter", "Bytes handled by each stage or step, e.g. downloaded.")
+    for row in stages:
+        if row["bytes"] is not None:
+            writer.sample("stage_bytes_total", row["bytes"], stage=row["stage"])
+
+    writer.declare("llm_tokens_total", "counter", "LLM tokens sent and generated.")
+    for row in stages:
+        if row["prompt_tokens"] is not None:
+            writer.sample("llm_tokens_total", row["prompt_tokens"], stage=row["stage"], type="prompt")
+            writer.sample("llm_tokens_total", row["completion_tokens"], stage=row["stage"], type="completion")
+
+
+def write_entry_metrics(writer: MetricsWriter) -> None:
+    writer.declare("entries", "gauge", "Entries per status; unfinished statuses are the queue depth of each stage.")
+    for status, count in Entry.select(Entry.status, fn.COUNT(Entry.id)).group_by(Entry.status).tuples():
+        writer.sample("entries", count, status=status)
+
+    items, size = CacheItem.select(fn.COUNT(CacheItem.id), fn.SUM(CacheItem.size)).scalar(as_tuple=True)
+    writer.declare("cache_items", "gauge", "Cached transcripts and summaries.")
+    writer.sample("cache_items", items)
+    writer.declare("cache_bytes", "gauge", "Size of the cached transcripts and summaries.")
+    writer.sample("cache_bytes", size)
+
+
+def render_metrics() -> str:
+    """Return all metrics in the Prometheus text exposition format."""
+    writer = MetricsWriter()
+    write_stage_metrics(writer)
+    write_entry_metrics(writer)
+    return writer.render()
@@ -1,47 +1,220 @@
 """Database model for the summarize API."""
 
+import zlib
+from datetime import datetime, timezone
 from pathlib import Path
 
 import structlog
 from peewee import (
+    BlobField,
+    BooleanField,
     CharField,
+    DateField,
     DateTimeField,
+    FloatField,
+    ForeignKeyField,
+    IntegerField,
     Model,
     SqliteDatabase,
     TextField,
 )
+from playhouse.migrate import SqliteMigrator, migrate
 
-from config import DATABASE_PATH
+from config import (
+    DATABASE_PATH,
+    SQLITE_BUSY_TIMEOUT,
+    SQLITE_CACHE_MB,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_MMAP_MB,
+)
 
 log = structlog.get_logger()
 
-# Database setup
-db = SqliteDatabase(DATABASE_PATH)
+# Database setup. The API and the daemon threads each use their own connection
+# (peewee keeps one per thread), opened and closed around each request or job.
+db = SqliteDatabase(
+    DATABASE_PATH,
+    timeout=SQLITE_BUSY_TIMEOUT,
+    pragmas={
+        # WAL lets API reads run while the daemon writes
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        # Safe with WAL: a power loss can only lose the last transactions
+        "synchronous": "normal",
+        "cache_size": -SQLITE_CACHE_MB * 1024,
+        "mmap_size": SQLITE_MMAP_MB * 1024 * 1024,
+        "busy_timeout": SQLITE_BUSY_TIMEOUT * 1000,
+    },
+)
 
 
 class BaseModel(Model):
     class Meta:
         database = db
+        # Only write changed columns, so a save() from one thread doesn't
+        # overwrite columns another thread updated in the meantime
+        only_save_dirty = True
 
 
 class Entry(BaseModel):
     """Model for storing video entries."""
 
     name = CharField()
-    status = CharField()
+    status = CharField(index=True)
     url = CharField(unique=True)
-    transcription = TextField(null=True)
     summary = TextField(null=True)
-    insertion_date = DateTimeField(null=False)
+    insertion_date = DateTimeField(null=False, index=True)
+    duration = IntegerField(null=True)  # Seconds
+    channel = CharField(null=True)
+    upload_date = DateField(null=True)
+    transcript_tokens = IntegerField(null=True)
+    prompt_tokens = IntegerField(null=True)  # Transcript tokens sent for summarization, after compaction
+    priority = IntegerField(default=0)  # Higher is processed first
+    submitter = CharField(null=True)  # Who added the entry, for fair sharing
+    playlist = CharField(null=True)  # URL of the playlist or channel it was imported from
+    audio_key = CharField(null=True)  # Transcript cache key of the downloaded audio
+    worker_id = CharField(null=True)
+    lease_expires_at = DateTimeField(null=True)
+    updated_at = DateTimeField(null=True, index=True)
+
+    def save(self, *args, **kwargs):
+        # Lets API clients ask for what changed since their last request, and
+        # feeds the /entries/events stream
+        self.updated_at = datetime.now(timezone.utc)
+        return super().save(*args, **kwargs)
+
+
+class Transcript(BaseModel):
+    """Transcript of an entry.
+
+    Kept out of the entry table, so status updates and list queries don't
+    touch pages full of transcript text.
+    """
+
+    entry = ForeignKeyField(Entry, primary_key=True, on_delete="CASCADE")
+    text = BlobField()  # zlib-compressed UTF-8
+
+
+def load_transcript(entry_id: int) -> str | None:
+    """Return the transcript of an entry, or None if it has none yet."""
+    transcript = Transcript.get_or_none(Transcript.entry == entry_id)
+    if transcript is None:
+        return None
+    return zlib.decompress(transcript.text).decode("utf-8")
+
+
+def store_transcript(entry_id: int, text: str) -> None:
+    """Store the transcript of an entry, replacing any previous one."""
+    Transcript.replace(entry=entry_id, text=zlib.compress(text.encode("utf-8"))).execute()
+
+
+class TranscriptCheckpoint(BaseModel):
+    """whisper output of one window of an entry's audio, saved as soon as it is transcribed.
+
+    If transcription is interrupted, it resumes after the last saved window.
+    The checkpoints are deleted once the whole transcript is stored.
+    """
+
+    entry = ForeignKeyField(Entry, index=True, on_delete="CASCADE")
+    start = FloatField()  # Seconds
+    end = FloatField()
+    output = TextField()
+
+
+def load_checkpoints(entry_id: int) -> dict[tuple[float, float], str]:
+    """Return the saved whisper output of an entry, by (start, end) of each window."""
+    query = TranscriptCheckpoint.select().where(TranscriptCheckpoint.entry == entry_id)
+    return {(checkpoint.start, checkpoint.end): checkpoint.output for checkpoint in query}
+
+
+def store_checkpoint(entry_id: int, start: float, end: float, output: str) -> None:
+    TranscriptCheckpoint.create(entry=entry_id, start=start, end=end, output=output)
+
+
+def clear_checkpoints(entry_id: int) -> None:
+    TranscriptCheckpoint.delete().where(TranscriptCheckpoint.entry == entry_id).execute()
+
+
+class StageTiming(BaseModel):
+    """How long one step of processing an entry took, and how much it processed."""
+
+    entry = ForeignKeyField(Entry, null=True, index=True, on_delete="CASCADE")
+    stage = CharField(index=True)  # A pipeline status, or a step like "llm_request"
+    started_at = DateTimeField(index=True)
+    duration = FloatField()  # Seconds
+    success = BooleanField()
+    audio_seconds = FloatField(null=True)
+    bytes = IntegerField(null=True)
+    prompt_tokens = IntegerField(null=True)
+    completion_tokens = IntegerField(null=True)
+
+
+class StageTotal(BaseModel):
+    """Totals of the StageTiming rows of a stage that were rolled up and deleted."""
+
+    stage = CharField(unique=True)
+    count = IntegerField()
+    duration = FloatField()
+    failures = IntegerField()
+    audio_seconds = FloatField(null=True)
+    bytes = IntegerField(null=True)
+    prompt_tokens = IntegerField(null=True)
+    completion_tokens = IntegerField(null=True)
+    buckets = TextField()  # JSON object of the number of runs up to each duration bucket bound
+
+
+class CacheItem(BaseModel):
+    """Cached transcript or summary, keyed by what it was computed from."""
+
+    key = CharField(unique=True)
+    value = TextField()
+    size = IntegerField()
+    last_used = DateTimeField(index=True)
+
+
+def migrate_db() -> None:
+    """Add columns that were introduced after the database was created."""
+    table = Entry._meta.table_name
+    existing_columns = {column.name for column in db.get_columns(table)}
+    migrator = SqliteMigrator(db)
+
+    operations = []
+    for field in Entry._meta.sorted_fields:
+        if field.column_name not in existing_columns:
+            log.info(f"Adding column {table}.{field.column_name}")
+            operations.append(migrator.add_column(table, field.column_name, field))
+
+    if operations:
+        migrate(*operations)
+
+
+def move_transcripts() -> None:
+    """Move transcripts from the old entry.transcription column to their own table."""
+    table = Entry._meta.table_name
+    if "transcription" not in {column.name for column in db.get_columns(table)}:
+        return
+
+    log.info("Moving transcripts out of the entry table...")
+    with db.atomic():
+        cursor = db.execute_sql(f"SELECT id, transcription FROM {table} WHERE transcription IS NOT NULL")
+        for entry_id, text in cursor.fetchall():
+            store_transcript(entry_id, text)
+        migrate(SqliteMigrator(db).drop_column(table, "transcription"))
+    # Give the freed pages back, the transcripts were most of the file
+    db.execute_sql("VACUUM")
 
 
-# Ensure database exists
+# Ensure database exists and is up to date
 def initialize_db() -> None:
     if not Path.exists(DATABASE_PATH):
         log.info("Database does not exist, initializing...")
-        db.connect()
-        db.create_tables([Entry])
-        db.close()
+    db.connect()
+    # Add new columns first, so indexes on them can be created below (and on
+    # existing columns too, as create_tables only adds missing indexes)
+    if db.table_exists(Entry._meta.table_name):
+        migrate_db()
+    db.create_tables([Entry, Transcript, TranscriptCheckpoint, StageTiming, StageTotal, CacheItem])
+    move_transcripts()
+    db.close()
 
 
 initialize_db()
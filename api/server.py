@@ -1,54 +1,301 @@
 """Contains the Flask API server for the video transcription project."""
 
+import base64
+import gzip
+import hashlib
+import json
+import queue
+from datetime import date, datetime, timezone
 from typing import Literal
 
 from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from peewee import IntegrityError
+from peewee import IntegrityError, fn
 import structlog
-import yt_dlp
 
+try:
+    import brotli
+except ImportError:  # Optional; responses fall back to gzip
+    brotli = None
+
+from config import INTERACTIVE_PRIORITY, SSE_KEEPALIVE_INTERVAL
+from events import subscribe, unsubscribe
 from helpers import create_or_reset_entry
-from model import Entry
+from ingest import get_job, is_single_video, start_import
+from metrics import render_metrics
+from model import Entry, db, load_transcript
 
 log = structlog.get_logger()
 
 server = Flask(__name__)
-CORS(server)
+CORS(server, expose_headers=["ETag", "X-Next-Cursor", "Content-Range", "Accept-Ranges"])
+
+@server.before_request
+def open_db_connection() -> None:
+    db.connect(reuse_if_open=True)
+
+
+@server.teardown_request
+def close_db_connection(exc: BaseException | None) -> None:
+    if not db.is_closed():
+        db.close()
+
+
+# Columns returned by the list endpoint
+LIST_FIELDS = [
+    Entry.id,
+    Entry.name,
+    Entry.status,
+    Entry.url,
+    # Summaries are fetched one at a time from /entries/<id>/summary
+    Entry.summary.is_null(False).alias("has_summary"),
+    Entry.insertion_date,
+    Entry.updated_at,
+    Entry.duration,
+    Entry.channel,
+    Entry.upload_date,
+    Entry.transcript_tokens,
+    Entry.prompt_tokens,
+    Entry.priority,
+]
+
+
+def format_date(value: date | datetime | str | None) -> str | None:
+    """Format a date column as an ISO string."""
+    if value and hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(entry: dict) -> str:
+    return base64.urlsafe_b64encode(f"{entry['insertion_date']}|{entry['id']}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    insertion_date, entry_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+    return insertion_date, int(entry_id)
+
+
+def parse_since(since: str) -> datetime:
+    """Parse an ISO timestamp, assuming UTC when it has no timezone."""
+    parsed = datetime.fromisoformat(since)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
 
 
 @server.route("/entries", methods=["GET"])
-def get_entries() -> Response:
-    """Return all database entries as JSON.
+def get_entries() -> Response | tuple[Response, Literal[400]]:
+    """Return database entries as JSON, newest first, without their transcripts or summaries.
+
+    Query parameters:
+        limit: Maximum number of entries to return. All entries when omitted.
+        cursor: Return the page after the one that sent this cursor in its
+            X-Next-Cursor header.
+        since: ISO timestamp; only return entries updated after it.
+
+    Every response has an ETag that changes whenever an entry is added or
+    updated, so a request with a matching If-None-Match gets an empty 304.
 
     Returns:
         Response: JSON response.
+        Literal[400]: HTTP 400 status code.
 
     """
-    entries = Entry.select().order_by(Entry.insertion_date.desc()).dicts()
+    count, last_update = Entry.select(fn.COUNT(Entry.id), fn.MAX(Entry.updated_at)).scalar(as_tuple=True)
+    version = f"{count}|{last_update}|{request.query_string.decode()}"
+    etag = hashlib.sha256(version.encode()).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    query = Entry.select(*LIST_FIELDS).order_by(Entry.insertion_date.desc(), Entry.id.desc())
+    try:
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+        if limit is not None and limit < 1:
+            raise ValueError(f"limit must be at least 1, got {limit}")
+        if "cursor" in request.args:
+            insertion_date, entry_id = decode_cursor(request.args["cursor"])
+            query = query.where(
+                (Entry.insertion_date < insertion_date)
+                | ((Entry.insertion_date == insertion_date) & (Entry.id < entry_id))
+            )
+        if "since" in request.args:
+            query = query.where(Entry.updated_at > parse_since(request.args["since"]))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    if limit is not None:
+        # Fetch one extra row to know whether there is a next page
+        query = query.limit(limit + 1)
+    entries = list(query.dicts())
+
+    next_cursor = None
+    if limit is not None and len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(entries[-1])
 
     for e in entries:
-        # return everything but the transcription
-        del e['transcription']
-        # format insertion_date as ISO string
-        if e['insertion_date'] and hasattr(e['insertion_date'], 'isoformat'):
-            e['insertion_date'] = e['insertion_date'].isoformat()
+        e["has_summary"] = bool(e["has_summary"])
+        e["insertion_date"] = format_date(e["insertion_date"])
+        e["updated_at"] = format_date(e["updated_at"])
+        e["upload_date"] = format_date(e["upload_date"])
+
+    response = jsonify(entries)
+    response.set_etag(etag)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+# Text smaller than this is sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+
+def text_response(entry: Entry, text: str, mimetype: str) -> Response:
+    """Send a transcript or summary with compression, range and cache support.
+
+    The text is compressed with br (when the brotli package is installed) or
+    gzip if the client accepts it. Range requests are answered uncompressed,
+    so byte offsets always refer to the plain text. Once the entry is done
+    its text never changes, so it may be cached forever.
+
+    Args:
+        entry: Entry the text belongs to.
+        text: Transcript or summary.
+        mimetype: Content type of the text.
+
+    Returns:
+        Response: 200, 206 (partial content), 304 (not modified) or 416
+            (range not satisfiable) response.
+
+    """
+    data = text.encode("utf-8")
+    etag = hashlib.sha256(data).hexdigest()[:32]
+
+    encoding = None
+    if "Range" not in request.headers and len(data) >= MIN_COMPRESS_SIZE:
+        if brotli is not None and "br" in request.accept_encodings:
+            encoding = "br"
+            data = brotli.compress(data, quality=5)
+        elif "gzip" in request.accept_encodings:
+            encoding = "gzip"
+            data = gzip.compress(data, compresslevel=6)
+
+    response = Response(data, mimetype=mimetype)
+    response.vary.add("Accept-Encoding")
+    if encoding:
+        response.content_encoding = encoding
+        # Each encoding is a different representation and needs its own ETag
+        etag = f"{etag}-{encoding}"
+    response.set_etag(etag)
+
+    if entry.status == "done":
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+
+    # Handles If-None-Match, Range and If-Range
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+
+@server.route("/entries/<int:entry_id>/transcript", methods=["GET"])
+def get_transcript(entry_id: int) -> Response | tuple[Response, Literal[404]]:
+    """Return the transcript of an entry as plain text.
 
-    return jsonify(list(entries))
+    Returns:
+        Response: Text response, see text_response.
+        Literal[404]: HTTP 404 status code.
+
+    """
+    entry = Entry.select(Entry.id, Entry.status).where(Entry.id == entry_id).first()
+    transcript = load_transcript(entry_id) if entry else None
+    if transcript is None:
+        return jsonify({"error": "Transcript not found"}), 404
+    return text_response(entry, transcript, "text/plain")
+
+
+@server.route("/entries/<int:entry_id>/summary", methods=["GET"])
+def get_summary(entry_id: int) -> Response | tuple[Response, Literal[404]]:
+    """Return the summary of an entry as Markdown.
+
+    While the entry is being summarized, this is the part written so far.
+
+    Returns:
+        Response: Text response, see text_response.
+        Literal[404]: HTTP 404 status code.
+
+    """
+    entry = Entry.get_or_none(Entry.id == entry_id)
+    if entry is None or entry.summary is None:
+        return jsonify({"error": "Summary not found"}), 404
+    return text_response(entry, entry.summary, "text/markdown")
+
+
+@server.route("/entries/events", methods=["GET"])
+def entry_events() -> Response:
+    """Stream entry changes as server-sent events.
+
+    Each event is a JSON object with the entry's id, status, name and whether
+    a summary is available. Entries the client has never seen should be
+    fetched from /entries, summaries from /entries/<id>/summary.
+
+    Returns:
+        Response: text/event-stream response that stays open.
+
+    """
+
+    def stream():
+        subscription = subscribe()
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = subscription.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    # Comment line that keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            unsubscribe(subscription)
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @server.route("/entries", methods=["POST"])
 def add_entry() -> (
     tuple[Response, Literal[400]]
+    | tuple[Response, Literal[200]]
     | tuple[Response, Literal[201]]
+    | tuple[Response, Literal[202]]
     | tuple[Response, Literal[409]]
 ):
     """Insert a new entry into the database.
 
+    Single YouTube videos are added right away. Playlists, channels and other
+    URLs are expanded by a background import job; follow its progress at the
+    returned status_url.
+
+    JSON fields:
+        url: Video, playlist or channel URL.
+        interactive: True when someone is waiting for the result, which
+            processes it before bulk work (INTERACTIVE_PRIORITY). Ignored
+            for playlists and channels.
+        submitter: Who is adding it, for sharing the daemon fairly between
+            submitters. Defaults to the client's IP address.
+
     Returns:
         Response: JSON response.
         Literal[400]: HTTP 400 status code.
+        Literal[200]: HTTP 200 status code.
         Literal[201]: HTTP 201 status code.
+        Literal[202]: HTTP 202 status code.
         Literal[409]: HTTP 409 status code.
 
     """
@@ -56,36 +303,61 @@ def add_entry() -> (
     if data is None or "url" not in data:
         return jsonify({"error": "Missing field 'url'"}), 400
 
-    ydl_opts = {"quiet": True, "noprogress": True, "extract_flat": True}
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(data["url"], download=False)
-    if not info:
-        msg = "failed to extract_info from youtube"
-        raise Exception(msg)
-
-    if info.get('entries'):
-        log.info("Adding playlist")
-        urls = [entry['url'] for entry in info['entries']]
-
-        for url in urls:
-            log.info(f"Adding video {url} to database")
-            try:
-                create_or_reset_entry(url)
-            except IntegrityError:
-                log.warning(f"A video with URL {url} already exists.")
-        return jsonify({"message": "Playlist added successfully."}), 201
-    else:
-        log.info("Adding video")
-        try:
-            log.info(f"Adding video {data['url']} to database")
-            entry, is_new = create_or_reset_entry(data["url"])
-            if is_new:
-                return jsonify({"message": "Video added successfully."}), 201
-            else:
-                return jsonify({"message": "Video reset and will be retried."}), 200
-        except IntegrityError:
-            log.warning(f"A video with URL {data['url']} already exists.")
-            return (
-                jsonify({"error": "A video with this URL already exists."}),
-                409,
-            )  # HTTP 409 Conflict
+    priority = INTERACTIVE_PRIORITY if data.get("interactive") else 0
+    submitter = data.get("submitter") or request.remote_addr
+
+    if not is_single_video(data["url"]):
+        log.info(f"Importing {data['url']}")
+        job_id = start_import(data["url"], priority, submitter)
+        return (
+            jsonify(
+                {
+                    "message": "Import started.",
+                    "job_id": job_id,
+                    "status_url": f"/imports/{job_id}",
+                }
+            ),
+            202,
+        )
+
+    log.info("Adding video")
+    try:
+        log.info(f"Adding video {data['url']} to database")
+        entry, is_new = create_or_reset_entry(data["url"], priority, submitter)
+        if is_new:
+            return jsonify({"message": "Video added successfully."}), 201
+        else:
+            return jsonify({"message": "Video reset and will be retried."}), 200
+    except IntegrityError:
+        log.warning(f"A video with URL {data['url']} already exists.")
+        return (
+            jsonify({"error": "A video with this URL already exists."}),
+            409,
+        )  # HTTP 409 Conflict
+
+
+@server.route("/metrics", methods=["GET"])
+def get_metrics() -> Response:
+    """Return stage timings, token usage and entries per status for Prometheus.
+
+    Returns:
+        Response: Metrics in the Prometheus text exposition format.
+
+    """
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@server.route("/imports/<job_id>", methods=["GET"])
+def get_import(job_id: str) -> Response | tuple[Response, Literal[404]]:
+    """Return the progress of an import job.
+
+    Returns:
+        Response: JSON with the job's status ("running", "done" or "error"),
+            total number of videos (once known) and number processed.
+        Literal[404]: HTTP 404 status code.
+
+    """
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown import job"}), 404
+    return jsonify(job)
@@ -0,0 +1,231 @@
+"""Lifecycle of the intermediate files in TEMP_DIR.
+
+Every file an entry leaves in TEMP_DIR starts with its id: the downloaded
+audio, the WAV converted from it, whisper's transcript and any chunks. They
+are all needed until the transcript is stored in the database, and deleted
+then, or TEMP_RETENTION seconds later when set, for debugging. sweep()
+deletes what crashed runs and failed entries left behind.
+
+With TEMP_MAX_BYTES set, downloads wait until there is room for the audio,
+its WAV and the chunks transcribed from it under the quota. Sizes that aren't
+known up front are assumed large, and estimated again from the downloaded
+file. The room stays reserved for the entry until its files are released, so
+what later stages write still fits.
+"""
+
+import os
+import re
+import threading
+import time
+from collections.abc import Iterable
+from pathlib import Path
+
+import structlog
+
+from config import (
+    AUDIO_SAMPLE_RATE,
+    TEMP_DIR,
+    TEMP_MAX_BYTES,
+    TEMP_RETENTION,
+    WHISPER_CHECKPOINT_SECONDS,
+    WHISPER_CHUNK_SECONDS,
+    WHISPER_PARALLEL_CHUNKS,
+)
+from model import Entry
+
+log = structlog.get_logger()
+
+# Entry id at the start of every intermediate file name
+ENTRY_FILE_PATTERN = re.compile(r"^(\d+)_")
+
+# Entries in these statuses need none of their files anymore. Entries in
+# earlier stages keep theirs, so an interrupted stage can pick up where it was.
+CONSUMED_STATUSES = ["summarizing", "done", "error"]
+
+# Bytes per second of the 16-bit mono WAV whisper.cpp reads
+WAV_BYTE_RATE = AUDIO_SAMPLE_RATE * 2
+
+# Assumed when a download's size or length isn't known before it finishes:
+# an hour of audio at 256 kbit/s, more than audio-only formats use
+FALLBACK_DURATION = 3600
+AUDIO_BYTE_RATE = 32_000
+
+# Seconds between checks while waiting for room under the quota
+QUOTA_WAIT_INTERVAL = 5
+
+# Bytes the files of each entry in progress are expected to take up
+reserved: dict[int, int] = {}
+reserved_lock = threading.Lock()
+
+
+def entry_files(entry: Entry) -> list[Path]:
+    return list(TEMP_DIR.glob(f"{entry.id}_*"))
+
+
+def scan_usage() -> tuple[int, dict[int, int]]:
+    """Return the total size of the files in TEMP_DIR, and the size of each entry's files."""
+    total = 0
+    entry_sizes: dict[int, int] = {}
+    with os.scandir(TEMP_DIR) as files:
+        for file in files:
+            try:
+                if not file.is_file():
+                    continue
+                size = file.stat().st_size
+            except OSError:
+                # Deleted while scanning
+                continue
+            total += size
+            match = ENTRY_FILE_PATTERN.match(file.name)
+            if match:
+                entry_id = int(match.group(1))
+                entry_sizes[entry_id] = entry_sizes.get(entry_id, 0) + size
+    return total, entry_sizes
+
+
+def disk_usage() -> int:
+    """Return the size of the files in TEMP_DIR, counting entries with a reservation at least at its size."""
+    total, entry_sizes = scan_usage()
+    # Files of reserved entries yet to be written, or still growing
+    return total + sum(max(0, needed - entry_sizes.get(entry_id, 0)) for entry_id, needed in reserved.items())
+
+
+def release(paths: Iterable[Path]) -> None:
+    """Delete intermediate files whose results are stored.
+
+    With TEMP_RETENTION set they are kept, and sweep() deletes them once they
+    are old enough.
+    """
+    if TEMP_RETENTION > 0:
+        return
+    for path in paths:
+        path.unlink(missing_ok=True)
+        log.debug(f"Deleted {path}")
+
+
+def sweep(keep_recent: bool = True) -> int:
+    """Delete the files of entries that no longer need them, and of deleted entries.
+
+    Args:
+        keep_recent: Keep files modified within TEMP_RETENTION seconds.
+
+    Returns:
+        int: Number of bytes freed.
+
+    """
+    files: dict[int, list[Path]] = {}
+    for path in TEMP_DIR.iterdir():
+        match = ENTRY_FILE_PATTERN.match(path.name)
+        if match and path.is_file():
+            files.setdefault(int(match.group(1)), []).append(path)
+    if not files:
+        return 0
+
+    # Ids without an entry belong to deleted entries
+    needed = {
+        entry_id
+        for (entry_id,) in Entry.select(Entry.id)
+        .where(Entry.id.in_(list(files)), Entry.status.not_in(CONSUMED_STATUSES))
+        .tuples()
+    }
+    cutoff = time.time() - TEMP_RETENTION if keep_recent else float("inf")
+
+    freed = 0
+    for entry_id, paths in files.items():
+        if entry_id in needed:
+            continue
+        for path in paths:
+            try:
+                stat = path.stat()
+                if stat.st_mtime > cutoff:
+                    continue
+                path.unlink()
+            except OSError:
+                continue
+            freed += stat.st_size
+
+    if freed:
+        log.info(f"Freed {freed / 1e6:.1f} MB of intermediate files in {TEMP_DIR}")
+    return freed
+
+
+def chunk_bytes(duration: float) -> int:
+    """Estimate the chunk WAVs written at once while transcribing a WAV of this length."""
+    if WHISPER_CHUNK_SECONDS > 0:
+        parallel = WHISPER_PARALLEL_CHUNKS
+        chunk_seconds = min(WHISPER_CHUNK_SECONDS, WHISPER_CHECKPOINT_SECONDS or WHISPER_CHUNK_SECONDS)
+    elif WHISPER_CHECKPOINT_SECONDS > 0:
+        parallel, chunk_seconds = 1, WHISPER_CHECKPOINT_SECONDS
+    else:
+        return 0
+    # Audio that fits in one chunk is transcribed as a whole
+    if duration <= chunk_seconds:
+        return 0
+    return int(min(parallel * chunk_seconds, duration) * WAV_BYTE_RATE)
+
+
+def expected_entry_bytes(audio_bytes: int | None, duration: float | None, convert: bool) -> int:
+    """Estimate the disk space all of an entry's files need at once.
+
+    Args:
+        audio_bytes: Size of the downloaded audio, if known.
+        duration: Length of the video in seconds, if known.
+        convert: Whether the audio will be converted to a WAV file, and
+            transcribed from it in chunks if those are enabled.
+
+    Returns:
+        int: Expected bytes, assuming FALLBACK_DURATION of audio for what
+            isn't known.
+
+    """
+    seconds = duration or FALLBACK_DURATION
+    audio = audio_bytes or seconds * AUDIO_BYTE_RATE
+    if not convert:
+        return int(audio)
+    return int(audio + seconds * WAV_BYTE_RATE + chunk_bytes(seconds))
+
+
+def reserve_space(entry: Entry, needed: int) -> None:
+    """Wait until needed bytes fit under TEMP_MAX_BYTES, and reserve them for the entry's files.
+
+    needed is what all of the entry's files will take up, including those
+    already written. While over the quota, files kept only for TEMP_RETENTION
+    are deleted first. A single entry bigger than the whole quota goes ahead
+    once TEMP_DIR is empty, rather than waiting forever. The reservation
+    holds until release_space() is called for the entry.
+
+    An entry that already holds a reservation, e.g. estimated again from its
+    downloaded file, gets the new size without waiting: entries that were let
+    in waiting on each other could wait forever.
+    """
+    if not TEMP_MAX_BYTES:
+        return
+
+    needed = min(needed, TEMP_MAX_BYTES)
+    waiting = False
+    while True:
+        with reserved_lock:
+            if entry.id in reserved:
+                reserved[entry.id] = needed
+                return
+            total, entry_sizes = scan_usage()
+            others = sum(
+                max(0, reserved_bytes - entry_sizes.get(entry_id, 0)) for entry_id, reserved_bytes in reserved.items()
+            )
+            # Files the entry already has, e.g. from an interrupted download, are part of needed
+            own = entry_sizes.get(entry.id, 0)
+            if total + others - own + max(needed, own) <= TEMP_MAX_BYTES:
+                reserved[entry.id] = needed
+                return
+        if sweep(keep_recent=False):
+            continue
+        if not waiting:
+            log.info(f"{TEMP_DIR} is near its {TEMP_MAX_BYTES / 1e6:g} MB quota, waiting to download")
+            waiting = True
+        time.sleep(QUOTA_WAIT_INTERVAL)
+
+
+def release_space(entry: Entry) -> None:
+    """Drop the entry's reservation; what its files still take up is counted as they are."""
+    with reserved_lock:
+        reserved.pop(entry.id, None)
@@ -1,22 +1,328 @@
-"""Generates a summary of a Youtube video transcript using an LLM."""
+"""Generates a summary of a Youtube video transcript using an LLM.
 
-from openai import OpenAI
+Transcripts longer than SUMMARY_CHUNK_TOKENS are summarized map-reduce style:
+each chunk is summarized on its own, concurrently, and a final request
+summarizes the video from the partial summaries.
 
-from config import LLM_API_KEY, LLM_BASE_URL, LLM_MAX_TOKENS, LLM_MODEL, LLM_TEMPERATURE
+The final request is streamed, so callers can show the summary as it is
+written and keep what was generated if the request fails.
 
-client = OpenAI(
+All requests go through one async client and connection pool. At most
+LLM_CONCURRENCY run at once, they are spaced out to stay within the
+provider's LLM_RPM and LLM_TPM limits, and throttled (429), failed (5xx) or
+timed out requests are retried.
+"""
+
+import asyncio
+import random
+import time
+from collections.abc import Awaitable, Callable
+
+import httpx
+import openai
+import structlog
+from openai import AsyncOpenAI
+
+from config import (
+    LLM_API_KEY,
+    LLM_BACKOFF_BASE,
+    LLM_BASE_URL,
+    LLM_CONCURRENCY,
+    LLM_MAX_TOKENS,
+    LLM_MODEL,
+    LLM_RETRIES,
+    LLM_RPM,
+    LLM_TEMPERATURE,
+    LLM_TIMEOUT,
+    LLM_TPM,
+    SUMMARY_CHUNK_TOKENS,
+    SUMMARY_FLUSH_TOKENS,
+)
+from timing import span
+from tokens import count_tokens, pack_texts
+
+log = structlog.get_logger()
+
+client = AsyncOpenAI(
     base_url=LLM_BASE_URL,
     api_key=LLM_API_KEY,
+    # Retried below instead, so retries also respect the rate limits
+    max_retries=0,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=LLM_CONCURRENCY, max_keepalive_connections=LLM_CONCURRENCY),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=10),
+    ),
 )
 
-def summarize_transcript(transcript: str) -> str:
-    prompt = f"Please summarize this video. Focus on the main takeaways, summarizing them. Start high level, then go into the details. When participants take specific positions, mention it. As always, keep an eye out for anything unusual or out of the especially notable.\n\n{transcript}\n"
 
-    response = client.chat.completions.create(
-        model=LLM_MODEL,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=LLM_TEMPERATURE,
-        max_tokens=LLM_MAX_TOKENS,
-    )
+class EmptyCompletionError(Exception):
+    """The model returned no text, e.g. filtered by the provider or a refusal."""
+
+
+# Throttling, server errors and network trouble, including a stream that breaks
+# off halfway, and empty answers, which a new sample often fixes
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+    httpx.TransportError,
+    EmptyCompletionError,
+)
+
+SUMMARY_PROMPT = "Please summarize this video. Focus on the main takeaways, summarizing them. Start high level, then go into the details. When participants take specific positions, mention it. As always, keep an eye out for anything unusual or out of the especially notable."
+
+PART_PROMPT = "This is part {part} of {parts} of {source}. Summarize this part. Keep its main takeaways and the details behind them, mention it when participants take specific positions, and keep anything unusual or especially notable. Your summary will be combined with the summaries of the other parts."
+
+COMBINE_PROMPT = "The video is too long to read at once, so here are summaries of its consecutive parts instead."
+
+
+class TokenBucket:
+    """Allow per_minute units a minute, in bursts of up to a minute's worth.
+
+    A per_minute of 0 disables the limit.
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def delay(self, amount: int) -> float:
+        """Return how many seconds to wait until amount units are available."""
+        if not self.capacity:
+            return 0
+        self.refill()
+        # Larger requests than a minute's worth wait for a full bucket
+        missing = min(amount, self.capacity) - self.level
+        return max(0, missing * 60 / self.capacity)
+
+    def take(self, amount: int) -> None:
+        """Use amount units; the level goes negative when more was used than was left."""
+        if self.capacity:
+            self.refill()
+            self.level -= amount
+
+
+class LlmRateLimiter:
+    """Keep requests within the provider's requests and tokens per minute limits."""
+
+    def __init__(self, rpm: int, tpm: int) -> None:
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.resume_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait until a request with a prompt of this many tokens is allowed, and reserve it."""
+        async with self.lock:
+            while True:
+                delay = max(
+                    self.resume_at - time.monotonic(),
+                    self.requests.delay(1),
+                    self.tokens.delay(tokens),
+                )
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+
+    def record(self, tokens: int) -> None:
+        """Count completion tokens, which are only known once they arrive."""
+        self.tokens.take(tokens)
+
+    def back_off(self, delay: float) -> None:
+        """Hold off all requests for delay seconds."""
+        self.resume_at = max(self.resume_at, time.monotonic() + delay)
+
+
+limiter = LlmRateLimiter(LLM_RPM, LLM_TPM)
+request_slots = asyncio.Semaphore(LLM_CONCURRENCY)
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Return the provider's Retry-After if it sent one, else an exponential backoff with jitter."""
+    if isinstance(error, openai.APIStatusError):
+        try:
+            return float(error.response.headers.get("retry-after", ""))
+        except ValueError:
+            pass
+    return LLM_BACKOFF_BASE * 2**attempt * random.uniform(0.5, 1.5)
+
+
+async def with_retries(request: Callable[[], Awaitable[str]], prompt_tokens: int) -> str:
+    """Send a request within the rate limits, retrying throttled and transient failures.
+
+    A 429 also holds off every other request for the same delay.
+
+    Args:
+        request: Sends the request and returns the completion.
+        prompt_tokens: Size of the request's prompt, for the token rate limit.
+
+    Raises:
+        openai.APIError: If the request keeps failing or the error is permanent.
+        EmptyCompletionError: If every attempt returned no text.
+
+    """
+    for attempt in range(LLM_RETRIES + 1):
+        await limiter.acquire(prompt_tokens)
+        try:
+            return await request()
+        except RETRYABLE_ERRORS as e:
+            if attempt == LLM_RETRIES:
+                raise
+
+            delay = retry_delay(e, attempt)
+            if isinstance(e, openai.RateLimitError):
+                limiter.back_off(delay)
+            log.warning(f"Retrying LLM request in {delay:.1f}s (attempt {attempt + 1}/{LLM_RETRIES}): {e!r}")
+            await asyncio.sleep(delay)
+
+    raise AssertionError("unreachable")
+
+
+async def complete(prompt: str) -> str:
+    async def request() -> str:
+        response = await client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=LLM_TEMPERATURE,
+            max_tokens=LLM_MAX_TOKENS,
+        )
+        content = response.choices[0].message.content
+        if not content:
+            finish_reason = response.choices[0].finish_reason
+            raise EmptyCompletionError(f"Empty completion (finish reason: {finish_reason})")
+        limiter.record(count_tokens(content))
+        return content
+
+    async with request_slots:
+        with span("llm_request", prompt_tokens=count_tokens(prompt)) as stats:
+            content = await with_retries(request, stats["prompt_tokens"])
+            stats["completion_tokens"] = count_tokens(content)
+            return content
+
+
+async def complete_streaming(
+    prompt: str,
+    partial: str | None = None,
+    on_progress: Callable[[str], None] | None = None,
+) -> str:
+    """Stream a completion, reporting the text generated so far as it grows.
+
+    Chat completion APIs don't continue a prefilled reply, so a stream that
+    breaks off is retried from the start, and so is a partial answer passed
+    in. The longest text so far stays on display until the new one is longer.
+
+    Args:
+        prompt: User prompt.
+        partial: Beginning of the answer from an earlier, interrupted request.
+        on_progress: Called with the whole text so far every
+            SUMMARY_FLUSH_TOKENS tokens.
+
+    Returns:
+        str: The complete answer.
+
+    """
+    if partial:
+        log.info(f"Regenerating summary interrupted after {count_tokens(partial)} tokens")
+    shown = len(partial or "")
+    text = ""
+    pending_tokens = 0
+
+    async def request() -> str:
+        nonlocal text, pending_tokens, shown
+        text = ""
+
+        stream = await client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=LLM_TEMPERATURE,
+            max_tokens=LLM_MAX_TOKENS,
+            stream=True,
+        )
+        async with stream:
+            async for chunk in stream:
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                delta = chunk.choices[0].delta.content
+                text += delta
+                tokens = count_tokens(delta)
+                limiter.record(tokens)
+                stats["completion_tokens"] += tokens
+                pending_tokens += tokens
+                if on_progress and pending_tokens >= SUMMARY_FLUSH_TOKENS and len(text) >= shown:
+                    on_progress(text)
+                    shown = len(text)
+                    pending_tokens = 0
+        if not text:
+            raise EmptyCompletionError("Empty completion")
+        return text
+
+    try:
+        async with request_slots:
+            with span("llm_request", prompt_tokens=count_tokens(prompt), completion_tokens=0) as stats:
+                return await with_retries(request, stats["prompt_tokens"])
+    except Exception:
+        # Hand over what was generated, so it can be shown until a retry gets further
+        if on_progress and pending_tokens and len(text) > shown:
+            on_progress(text)
+        raise
+
+
+async def summarize_parts(parts: list[str], source: str) -> list[str]:
+    """Summarize each part concurrently, returning the summaries in order.
+
+    Args:
+        parts: Consecutive chunks of text.
+        source: What the chunks are parts of, for the prompt.
+
+    """
+    prompts = [
+        f"{PART_PROMPT.format(part=i, parts=len(parts), source=source)}\n\n{part}\n"
+        for i, part in enumerate(parts, start=1)
+    ]
+    # Cancels the other parts as soon as one fails
+    async with asyncio.TaskGroup() as group:
+        tasks = [group.create_task(complete(prompt)) for prompt in prompts]
+    return [task.result() for task in tasks]
+
+
+async def summarize_transcript(
+    transcript: str,
+    partial: str | None = None,
+    on_progress: Callable[[str], None] | None = None,
+) -> str:
+    """Summarize a transcript, streaming the final summary.
+
+    Args:
+        transcript: Cleaned transcript.
+        partial: Summary text saved from an earlier, interrupted attempt,
+            shown until the new summary is longer.
+        on_progress: Called with the summary so far as it is written.
+
+    Returns:
+        str: The summary.
+
+    """
+    chunks = pack_texts(transcript.splitlines(), SUMMARY_CHUNK_TOKENS)
+    if len(chunks) <= 1:
+        return await complete_streaming(f"{SUMMARY_PROMPT}\n\n{transcript}\n", partial, on_progress)
+
+    log.info(f"Summarizing transcript in {len(chunks)} parts")
+    summaries = await summarize_parts(chunks, "a video transcript")
+
+    # Summaries of very long videos may still not fit; combine them in rounds
+    while len(summaries) > 1 and count_tokens("\n\n".join(summaries)) > SUMMARY_CHUNK_TOKENS:
+        groups = pack_texts(summaries, SUMMARY_CHUNK_TOKENS, "\n\n")
+        if len(groups) == len(summaries):
+            break
+        summaries = await summarize_parts(groups, "the summaries of a long video transcript")
 
-    return response.choices[0].message.content
+    combined = "\n\n".join(summaries)
+    return await complete_streaming(f"{SUMMARY_PROMPT}\n\n{COMBINE_PROMPT}\n\n{combined}\n", partial, on_progress)
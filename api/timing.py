@@ -0,0 +1,57 @@
+"""Time the steps of processing an entry and store the timings in the database.
+
+Timings are stored as StageTiming rows, which /metrics aggregates. Spans opened
+while a stage works on an entry are attributed to that entry without it being
+passed down, through the current_entry context variable.
+"""
+
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+import structlog
+
+from model import StageTiming
+
+log = structlog.get_logger()
+
+# Id of the entry the current thread or task is working on
+current_entry: ContextVar[int | None] = ContextVar("current_entry", default=None)
+
+
+@contextmanager
+def span(stage: str, **details) -> Iterator[dict]:
+    """Time a block of work and store it as a StageTiming row.
+
+    The block can add details (audio_seconds, bytes, prompt_tokens,
+    completion_tokens) to the yielded dict, and set "success" to False for
+    failures that don't raise.
+
+    Args:
+        stage: Name of the step, e.g. "transcribing" or "llm_request".
+        details: Initial details.
+
+    """
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    details.setdefault("success", True)
+    try:
+        yield details
+    except BaseException:
+        details["success"] = False
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        try:
+            StageTiming.create(
+                entry=current_entry.get(),
+                stage=stage,
+                started_at=started_at,
+                duration=duration,
+                **details,
+            )
+        except Exception as e:
+            # Timings must never break processing
+            log.warning(f"Could not record timing for {stage}: {e}")
@@ -0,0 +1,74 @@
+"""Token counting for LLM prompts.
+
+Tokens are counted with tiktoken. When its encoding can't be loaded (tiktoken
+downloads it on first use, so e.g. offline), they are estimated at about four
+characters per token.
+"""
+
+import functools
+
+import structlog
+import tiktoken
+
+from config import TOKENIZER_ENCODING
+
+log = structlog.get_logger()
+
+
+@functools.cache
+def get_encoding():
+    try:
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        log.warning(f"Cannot load tokenizer {TOKENIZER_ENCODING}, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens in a text."""
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    # Text that happens to look like a special token is counted as plain text
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def pack_texts(texts: list[str], max_tokens: int, separator: str = "\n") -> list[str]:
+    """Join consecutive texts into chunks of at most max_tokens tokens each.
+
+    Texts are never reordered. A single text longer than max_tokens is split
+    between words.
+
+    Args:
+        texts: Pieces of text, e.g. the lines of a transcript.
+        max_tokens: Token budget per chunk.
+        separator: String used to join pieces within a chunk.
+
+    Returns:
+        list[str]: Chunks of text.
+
+    """
+    chunks = []
+    current: list[str] = []
+    current_tokens = 0
+
+    for text in texts:
+        tokens = count_tokens(text)
+        if tokens > max_tokens:
+            if current:
+                chunks.append(separator.join(current))
+                current, current_tokens = [], 0
+            words = text.split()
+            step = max(1, len(words) * max_tokens // tokens)
+            chunks.extend(" ".join(words[i : i + step]) for i in range(0, len(words), step))
+            continue
+
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
@@ -1,56 +1,54 @@
 """Transcribe audio files using whisper.cpp."""
 
+import atexit
 import re
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+import httpx
 import structlog
 
 from config import (
+    AUDIO_SAMPLE_RATE,
+    AUDIO_STREAMING,
+    WHISPER_BACKEND,
     WHISPER_BEAM_SIZE,
     WHISPER_BINARY,
+    WHISPER_CHECKPOINT_SECONDS,
+    WHISPER_CHUNK_SECONDS,
     WHISPER_ENTROPY_THRESHOLD,
     WHISPER_LANGUAGE,
     WHISPER_MAX_CONTEXT,
     WHISPER_MODEL,
+    WHISPER_PARALLEL_CHUNKS,
+    WHISPER_SERVER_BINARY,
+    WHISPER_SERVER_PORT,
+    WHISPER_SERVER_STARTUP_TIMEOUT,
     WHISPER_SUPPRESS_NON_SPEECH,
     WHISPER_THREADS,
 )
+from model import load_checkpoints, store_checkpoint
+from timing import span
+from vad import find_silences, get_duration, plan_chunks, write_chunk
 
 log = structlog.get_logger()
 
+# A whisper-cli output line, e.g. "[00:01:02.500 --> 00:01:05.000]  Hello there."
+SEGMENT_PATTERN = re.compile(
+    r"^\[(\d+):(\d\d):(\d\d\.\d{3}) --> (\d+):(\d\d):(\d\d\.\d{3})\]\s*(.*)$"
+)
 
-def transcribe_audio(audio_path: str) -> str | None:
-    """Run whisper.cpp to generate a transcription.
-
-    Args:
-        audio_path (str): Path to the audio file.
-
-    Returns:
-        str: Transcription of the audio.
-
-    """
-    if not Path.exists(audio_path):
-        log.error(f"Audio file not found: {audio_path}")
-        return None
-
-    transcript_path = Path(f"{audio_path}.txt")
 
-    # Avoid re-transcribing if transcript already exists
-    if transcript_path.exists() and transcript_path.stat().st_size > 0:
-        log.info(f"Using existing transcript: {transcript_path}")
-        with Path.open(transcript_path) as f:
-            return f.read()
-
-    log.info("Transcribing audio...")
-    transcription_cmd = [
-        str(WHISPER_BINARY),
+def whisper_options(threads: int) -> list[str]:
+    """Model and decoding options shared by whisper-cli and whisper-server."""
+    options = [
         "-m",
         str(WHISPER_MODEL),
-        "-f",
-        str(audio_path),
         "-t",
-        str(WHISPER_THREADS),
+        str(threads),
         "-l",
         WHISPER_LANGUAGE,
         "--entropy-thold",
@@ -59,47 +57,388 @@ def transcribe_audio(audio_path: str) -> str | None:
         str(WHISPER_BEAM_SIZE),
         "--max-context",
         str(WHISPER_MAX_CONTEXT),
-        "-otxt",
     ]
 
     # Add optional flags
     if WHISPER_SUPPRESS_NON_SPEECH:
-        transcription_cmd.append("--suppress-nst")
+        options.append("--suppress-nst")
 
-    try:
-        with Path.open(transcript_path, "w") as f:
-            result = subprocess.run(
-                transcription_cmd,
-                stdout=f,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=False,
-            )
+    return options
+
+
+class CliBackend:
+    """Run whisper-cli for every file. Simple, but loads the model on every run."""
+
+    def transcribe(self, audio_path: Path, threads: int) -> str | None:
+        """Transcribe a WAV file and return whisper's timestamped output.
+
+        Args:
+            audio_path (Path): Path to the WAV file.
+            threads (int): Number of threads for whisper to use.
+
+        Returns:
+            str: whisper-cli output, one "[start --> end]  text" line per segment.
+
+        """
+        transcription_cmd = [str(WHISPER_BINARY), "-f", str(audio_path), *whisper_options(threads)]
+
+        result = subprocess.run(
+            transcription_cmd,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
 
         if result.returncode != 0:
             log.error(f"Whisper command failed: {result.stderr}")
             return None
 
-        log.info(f"Transcription completed: {transcript_path}")
+        return result.stdout
+
+    def transcribe_stream(self, source_path: Path, threads: int) -> str | None:
+        """Decode any audio file with ffmpeg and pipe it straight into whisper-cli.
+
+        No intermediate WAV file is written.
+
+        Args:
+            source_path (Path): Path to the audio file, in any format ffmpeg reads.
+            threads (int): Number of threads for whisper to use.
+
+        Returns:
+            str: whisper-cli output, one "[start --> end]  text" line per segment.
+
+        """
+        decoder = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-nostdin",
+                "-loglevel",
+                "error",
+                "-i",
+                str(source_path),
+                "-ar",
+                str(AUDIO_SAMPLE_RATE),
+                "-ac",
+                "1",
+                "-c:a",
+                "pcm_s16le",
+                "-f",
+                "wav",
+                "-",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        whisper = subprocess.Popen(
+            [str(WHISPER_BINARY), "-f", "-", *whisper_options(threads)],
+            stdin=decoder.stdout,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        # Let ffmpeg get SIGPIPE if whisper exits early
+        decoder.stdout.close()
+
+        output, errors = whisper.communicate()
+        decoder.wait()
+
+        if decoder.returncode != 0:
+            log.error(f"ffmpeg failed to decode {source_path}: {decoder.stderr.read().decode(errors='replace')}")
+            return None
+        if whisper.returncode != 0:
+            log.error(f"Whisper command failed: {errors}")
+            return None
+
+        return output
+
+
+class ServerBackend:
+    """Keep a whisper-server process running with the model loaded, and post audio to it.
+
+    The server is started on first use and lives as long as the daemon, so the
+    model is loaded once instead of once per video. It decodes one request at a
+    time with WHISPER_THREADS threads. If the server cannot be started or a
+    request fails, the file is transcribed with the fallback backend instead.
+    """
+
+    def __init__(self, fallback: CliBackend) -> None:
+        self.fallback = fallback
+        self.process: subprocess.Popen | None = None
+        self.lock = threading.Lock()
+        self.client = httpx.Client(base_url=f"http://127.0.0.1:{WHISPER_SERVER_PORT}", timeout=None)
+        atexit.register(self.stop)
+
+    def start(self) -> None:
+        """Start whisper-server unless it is already running, and wait until it is ready."""
+        with self.lock:
+            if self.process and self.process.poll() is None:
+                return
+
+            log.info("Starting whisper-server...")
+            self.process = subprocess.Popen(
+                [
+                    str(WHISPER_SERVER_BINARY),
+                    "--host",
+                    "127.0.0.1",
+                    "--port",
+                    str(WHISPER_SERVER_PORT),
+                    *whisper_options(WHISPER_THREADS),
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+
+            deadline = time.monotonic() + WHISPER_SERVER_STARTUP_TIMEOUT
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"whisper-server exited with code {self.process.returncode}")
+                try:
+                    self.client.get("/", timeout=1)
+                    log.info(f"whisper-server ready on port {WHISPER_SERVER_PORT}")
+                    return
+                except httpx.TransportError:
+                    time.sleep(0.5)
+
+            self.process.kill()
+            raise RuntimeError("Timed out waiting for whisper-server to start")
+
+    def stop(self) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+    def transcribe(self, audio_path: Path, threads: int) -> str | None:
+        """Transcribe a WAV file and return its segments in whisper-cli's output format.
+
+        Args:
+            audio_path (Path): Path to the WAV file.
+            threads (int): Only used by the fallback backend; the server's thread
+                count is fixed when it starts.
+
+        Returns:
+            str: One "[start --> end]  text" line per segment.
+
+        """
+        try:
+            self.start()
+            with Path.open(audio_path, "rb") as f:
+                response = self.client.post(
+                    "/inference",
+                    files={"file": (audio_path.name, f, "audio/wav")},
+                    data={"response_format": "verbose_json"},
+                )
+            response.raise_for_status()
+        except (OSError, RuntimeError, httpx.HTTPError) as e:
+            log.warning(f"whisper-server failed, falling back to whisper-cli: {e}")
+            return self.fallback.transcribe(audio_path, threads)
+
+        return "".join(
+            f"[{format_timestamp(segment['start'])} --> {format_timestamp(segment['end'])}]  {segment['text'].strip()}\n"
+            for segment in response.json()["segments"]
+        )
+
+
+cli_backend = CliBackend()
+backend = ServerBackend(fallback=cli_backend) if WHISPER_BACKEND == "server" else cli_backend
+
+
+def can_stream(duration: float | None = None) -> bool:
+    """Whether audio can be piped to whisper without converting it to a WAV file first.
+
+    Audio known to be longer than WHISPER_CHECKPOINT_SECONDS is converted, so
+    it can be transcribed in checkpointed windows.
+
+    Args:
+        duration: Length of the audio in seconds, if known.
+
+    """
+    if not AUDIO_STREAMING or backend is not cli_backend or WHISPER_CHUNK_SECONDS > 0:
+        return False
+    return not (WHISPER_CHECKPOINT_SECONDS > 0 and duration and duration > WHISPER_CHECKPOINT_SECONDS)
+
+
+def format_timestamp(seconds: float) -> str:
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def parse_segments(output: str) -> list[tuple[float, float, str]]:
+    """Parse whisper-cli output into (start, end, text) segments."""
+    segments = []
+    for line in output.splitlines():
+        match = SEGMENT_PATTERN.match(line)
+        if not match:
+            continue
+        h1, m1, s1, h2, m2, s2, text = match.groups()
+        start = int(h1) * 3600 + int(m1) * 60 + float(s1)
+        end = int(h2) * 3600 + int(m2) * 60 + float(s2)
+        segments.append((start, end, text))
+    return segments
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", "", text.lower()).split())
+
+
+def stitch_chunks(outputs: list[str], chunks: list[tuple[float, float]]) -> str:
+    """Join per-chunk whisper outputs into one transcript on the original timeline.
+
+    Timestamps are shifted by each chunk's start. Segments at the start of a chunk
+    that repeat one of the last segments of the previous chunk are dropped, since
+    whisper tends to repeat itself around a cut.
+
+    Args:
+        outputs: whisper-cli output of each chunk.
+        chunks: (start, end) time in seconds of each chunk.
+
+    Returns:
+        str: Combined transcript in whisper-cli output format.
+
+    """
+    lines = []
+    previous_tail: list[str] = []
+
+    for output, (offset, _) in zip(outputs, chunks):
+        segments = parse_segments(output)
+
+        while segments and normalize_text(segments[0][2]) in previous_tail:
+            segments.pop(0)
+
+        for start, end, text in segments:
+            lines.append(f"[{format_timestamp(start + offset)} --> {format_timestamp(end + offset)}]  {text}")
+
+        if segments:
+            previous_tail = [normalize_text(text) for _, _, text in segments[-2:]]
+
+    return "\n".join(lines) + "\n"
+
+
+def transcribe_chunked(
+    audio_path: Path, chunk_seconds: float, parallel: int, entry_id: int | None = None
+) -> str | None:
+    """Split a WAV file at silences and transcribe the chunks, parallel at a time.
+
+    With an entry_id, each chunk's output is saved as a checkpoint as soon as
+    it is done, and chunks saved by an earlier, interrupted run are not
+    transcribed again. The chunks are planned from the audio alone, so a rerun
+    plans the same ones.
+
+    Args:
+        audio_path (Path): Path to the WAV file.
+        chunk_seconds (float): Target chunk length in seconds.
+        parallel (int): Number of chunks to transcribe at once.
+        entry_id (int): Entry to save checkpoints for.
+
+    Returns:
+        str: Combined transcript, or None if any chunk failed.
+
+    """
+    duration = get_duration(audio_path)
+    chunks = plan_chunks(duration, find_silences(audio_path), chunk_seconds)
+    if len(chunks) == 1:
+        return backend.transcribe(audio_path, WHISPER_THREADS)
+
+    # Checkpoints of another plan (e.g. after a settings change) don't line up, and are ignored
+    checkpoints = load_checkpoints(entry_id) if entry_id else {}
+    outputs = {index: checkpoints[chunk] for index, chunk in enumerate(chunks) if chunk in checkpoints}
+    pending = [index for index in range(len(chunks)) if index not in outputs]
+    if outputs:
+        log.info(f"Resuming transcription, {len(outputs)} of {len(chunks)} chunks already done")
+
+    parallel = max(1, min(parallel, len(pending)))
+    threads = max(1, WHISPER_THREADS // parallel)
+    log.info(f"Transcribing {len(pending)} chunks, {parallel} at a time with {threads} threads each")
+
+    def transcribe_chunk(index: int) -> str | None:
+        chunk_path = write_chunk(audio_path, chunks[index], index)
+        try:
+            return backend.transcribe(chunk_path, threads)
+        finally:
+            chunk_path.unlink(missing_ok=True)
+
+    failed = False
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = {executor.submit(transcribe_chunk, index): index for index in pending}
+        # Checkpoints are saved from this thread, which has a database connection
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            output = future.result()
+            if output is None:
+                # Start no more chunks, but keep the ones still running when they finish
+                failed = True
+                for other in futures:
+                    other.cancel()
+                continue
+            index = futures[future]
+            outputs[index] = output
+            if entry_id:
+                store_checkpoint(entry_id, *chunks[index], output)
+
+    if failed:
+        return None
+
+    return stitch_chunks([outputs[index] for index in range(len(chunks))], chunks)
+
+
+def transcribe_audio(
+    audio_path: Path, transcript_path: Path | None = None, entry_id: int | None = None
+) -> str | None:
+    """Run whisper.cpp to generate a transcription.
+
+    WAV files longer than WHISPER_CHUNK_SECONDS (if set) are transcribed in
+    chunks, in parallel. WAV files longer than WHISPER_CHECKPOINT_SECONDS are
+    transcribed in windows of that length, one after the other. Either way,
+    with an entry_id every chunk or window is checkpointed. Other audio files
+    are decoded by ffmpeg and piped straight into whisper-cli.
+
+    Args:
+        audio_path (Path): Path to the audio file.
+        transcript_path (Path): Where to save the transcript. Defaults to the
+            audio path with ".txt" appended.
+        entry_id (int): Entry to save and resume checkpoints for.
+
+    Returns:
+        str: Transcription of the audio.
+
+    """
+    if not Path.exists(audio_path):
+        log.error(f"Audio file not found: {audio_path}")
+        return None
+
+    transcript_path = transcript_path or Path(f"{audio_path}.txt")
+
+    # Avoid re-transcribing if transcript already exists
+    if transcript_path.exists() and transcript_path.stat().st_size > 0:
+        log.info(f"Using existing transcript: {transcript_path}")
         with Path.open(transcript_path) as f:
             return f.read()
-    except Exception as e:
-        log.exception(f"Error during transcription: {e}")
-        return None
 
+    log.info("Transcribing audio...")
+    try:
+        with span("whisper") as stats:
+            if audio_path.suffix != ".wav":
+                transcription = cli_backend.transcribe_stream(audio_path, WHISPER_THREADS)
+            else:
+                stats["audio_seconds"] = get_duration(audio_path)
+                if WHISPER_CHUNK_SECONDS > 0:
+                    chunk_seconds = min(WHISPER_CHUNK_SECONDS, WHISPER_CHECKPOINT_SECONDS or WHISPER_CHUNK_SECONDS)
+                    transcription = transcribe_chunked(audio_path, chunk_seconds, WHISPER_PARALLEL_CHUNKS, entry_id)
+                elif WHISPER_CHECKPOINT_SECONDS > 0:
+                    transcription = transcribe_chunked(audio_path, WHISPER_CHECKPOINT_SECONDS, 1, entry_id)
+                else:
+                    transcription = backend.transcribe(audio_path, WHISPER_THREADS)
+            stats["success"] = transcription is not None
 
-def clean_transcript(transcript: str) -> str:
-    cleaned_lines = []
-    previous_line = None
+        if transcription is None:
+            return None
 
-    for line in transcript.splitlines():
-        # Remove null bytes
-        line = line.replace("\x00", "")
-        # Remove timestamps (e.g., [00:00:00.000])
-        line = re.sub(r"\[.*?\]\s*", "", line)
-        # Skip if it's the same as the previous line
-        if line != previous_line:
-            cleaned_lines.append(line)
-        previous_line = line
+        with Path.open(transcript_path, "w") as f:
+            f.write(transcription)
 
-    return "\n".join(cleaned_lines)
+        log.info(f"Transcription completed: {transcript_path}")
+        return transcription
+    except Exception as e:
+        log.exception(f"Error during transcription: {e}")
+        return None
@@ -0,0 +1,141 @@
+"""Split 16-bit mono WAV files into chunks at silences.
+
+Silence is detected with a simple energy pass: the audio is cut into short
+frames and a frame is silent when its RMS level is below VAD_SILENCE_DB.
+"""
+
+import math
+import operator
+import sys
+import wave
+from array import array
+from pathlib import Path
+
+import structlog
+
+from config import VAD_FRAME_MS, VAD_MIN_SILENCE_MS, VAD_SILENCE_DB
+
+log = structlog.get_logger()
+
+
+def get_duration(wav_path: Path) -> float:
+    """Return the duration of a WAV file in seconds."""
+    with wave.open(str(wav_path), "rb") as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+def find_silences(wav_path: Path) -> list[tuple[float, float]]:
+    """Find stretches of silence in a 16-bit mono WAV file.
+
+    Args:
+        wav_path: Path to the WAV file.
+
+    Returns:
+        List of (start, end) times in seconds of silences at least
+        VAD_MIN_SILENCE_MS long.
+
+    """
+    threshold = 32768 * 10 ** (VAD_SILENCE_DB / 20)
+    silences = []
+    silence_start = None
+
+    with wave.open(str(wav_path), "rb") as wav:
+        if wav.getsampwidth() != 2 or wav.getnchannels() != 1:
+            raise ValueError(f"Expected 16-bit mono WAV: {wav_path}")
+
+        rate = wav.getframerate()
+        frame_size = max(1, rate * VAD_FRAME_MS // 1000)
+        position = 0
+
+        while True:
+            # Read a few seconds at a time to keep memory flat on long files
+            samples = array("h", wav.readframes(frame_size * 100))
+            if not samples:
+                break
+            if sys.byteorder == "big":
+                samples.byteswap()
+
+            for i in range(0, len(samples), frame_size):
+                frame = samples[i : i + frame_size]
+                rms = math.sqrt(sum(map(operator.mul, frame, frame)) / len(frame))
+                time = (position + i) / rate
+
+                if rms < threshold:
+                    if silence_start is None:
+                        silence_start = time
+                elif silence_start is not None:
+                    silences.append((silence_start, time))
+                    silence_start = None
+
+            position += len(samples)
+
+        if silence_start is not None:
+            silences.append((silence_start, position / rate))
+
+    min_silence = VAD_MIN_SILENCE_MS / 1000
+    return [(start, end) for start, end in silences if end - start >= min_silence]
+
+
+def plan_chunks(
+    duration: float, silences: list[tuple[float, float]], chunk_seconds: float
+) -> list[tuple[float, float]]:
+    """Choose chunk boundaries close to chunk_seconds apart, cutting inside silences.
+
+    Each cut is placed in the middle of the longest silence in the last quarter
+    of the chunk. Without any silence there, the chunk is cut at chunk_seconds.
+
+    Args:
+        duration: Total audio duration in seconds.
+        silences: Silences as returned by find_silences.
+        chunk_seconds: Target chunk length in seconds.
+
+    Returns:
+        List of (start, end) times in seconds covering the whole audio.
+
+    """
+    chunks = []
+    start = 0.0
+
+    while duration - start > chunk_seconds:
+        target = start + chunk_seconds
+        window_start = target - chunk_seconds / 4
+        candidates = [
+            (end - begin, (begin + end) / 2)
+            for begin, end in silences
+            if window_start <= (begin + end) / 2 <= target
+        ]
+        cut = max(candidates)[1] if candidates else target
+        chunks.append((start, cut))
+        start = cut
+
+    chunks.append((start, duration))
+    return chunks
+
+
+def write_chunk(wav_path: Path, chunk: tuple[float, float], index: int) -> Path:
+    """Write one chunk of a WAV file to its own WAV file next to it.
+
+    Chunks are written one at a time, right before they are transcribed, so
+    only the chunks being worked on take up disk space.
+
+    Args:
+        wav_path: Path to the source WAV file.
+        chunk: (start, end) time in seconds, as returned by plan_chunks.
+        index: Position of the chunk, used in the file name.
+
+    Returns:
+        Path of the chunk file.
+
+    """
+    start, end = chunk
+    chunk_path = wav_path.with_name(f"{wav_path.stem}.chunk{index:03d}.wav")
+    with wave.open(str(wav_path), "rb") as source:
+        rate = source.getframerate()
+        first_frame = int(start * rate)
+        source.setpos(first_frame)
+        with wave.open(str(chunk_path), "wb") as output:
+            output.setparams(source.getparams())
+            output.writeframes(source.readframes(int(end * rate) - first_frame))
+
+    log.debug(f"Wrote chunk {index} of {wav_path} ({start:.1f}s to {end:.1f}s)")
+    return chunk_path
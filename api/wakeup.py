@@ -0,0 +1,59 @@
+"""Wake the daemon as soon as work is queued, instead of waiting for its next poll.
+
+Within one process (app.py runs the API and the daemon together) notify() sets
+a threading.Event the daemon waits on. When the daemon runs as a separate
+process, it listens for UDP datagrams on WAKEUP_PORT and notify() sends one
+there, which the listener turns into the same event.
+"""
+
+import socket
+import threading
+
+import structlog
+
+from config import WAKEUP_HOST, WAKEUP_PORT
+
+log = structlog.get_logger()
+
+_event = threading.Event()
+_listening = threading.Event()
+
+
+def notify() -> None:
+    """Tell the daemon there may be new work. Never raises."""
+    _event.set()
+    if _listening.is_set():
+        return
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b"wake", (WAKEUP_HOST, WAKEUP_PORT))
+    except OSError as e:
+        log.debug(f"Could not send wakeup datagram: {e}")
+
+
+def wait(timeout: float) -> bool:
+    """Block until notified or until timeout seconds have passed.
+
+    Returns:
+        True if woken by a notification, False on timeout.
+
+    """
+    woken = _event.wait(timeout)
+    _event.clear()
+    return woken
+
+
+def listen() -> None:
+    """Turn datagrams received on WAKEUP_PORT into wakeups. Runs forever."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            sock.bind((WAKEUP_HOST, WAKEUP_PORT))
+        except OSError as e:
+            log.warning(f"Cannot listen for wakeups on {WAKEUP_HOST}:{WAKEUP_PORT}, relying on polling: {e}")
+            return
+
+        _listening.set()
+        while True:
+            sock.recv(64)
+            _event.set()
@@ -2,6 +2,7 @@
 
 import { useState } from "react";
 import { useVideos } from "@/hooks/useVideos";
+import { useSummaries } from "@/hooks/useSummaries";
 import VideoForm from "@/components/VideoForm";
 import VideoTable from "@/components/VideoTable";
 import SummaryPanel from "@/components/SummaryPanel";
@@ -10,6 +11,7 @@ export default function Home() {
   const { entries, error, refetch } = useVideos();
   const [selectedVideos, setSelectedVideos] = useState({});
   const [lastSelectedIndex, setLastSelectedIndex] = useState(null);
+  const summaries = useSummaries(entries, selectedVideos);
 
   const backendPort = process.env.NEXT_PUBLIC_BACKEND_PORT || '3669';
   const serverUrl = typeof window !== 'undefined'
@@ -25,7 +27,7 @@ export default function Home() {
   };
 
   const handleRowClick = (index, url, event) => {
-    if (!entries[index].summary) return;
+    if (!entries[index].has_summary) return;
 
     if (event.shiftKey && lastSelectedIndex !== null) {
       // Determine range (start and end indices)
@@ -37,7 +39,7 @@ export default function Home() {
 
       // Set all items in range to true (selected)
       for (let i = start; i <= end; i++) {
-        if (entries[i].summary) {
+        if (entries[i].has_summary) {
           newSelections[entries[i].url] = true;
         }
       }
@@ -51,9 +53,9 @@ export default function Home() {
 
   const copySelectedSummaries = () => {
     const selectedSummaries = entries
-      .filter((video) => selectedVideos[video.url] && video.summary)
+      .filter((video) => selectedVideos[video.url] && summaries[video.id])
       .map((video) => {
-        return `## ${video.name}\n\n${video.summary}\n\n---\n\n`;
+        return `## ${video.name}\n\n${summaries[video.id]}\n\n---\n\n`;
       })
       .join("");
 
@@ -89,6 +91,7 @@ export default function Home() {
         <section className="content-section">
           <SummaryPanel
             entries={entries}
+            summaries={summaries}
             selectedVideos={selectedVideos}
             onCopy={copySelectedSummaries}
           />
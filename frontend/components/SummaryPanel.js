@@ -2,13 +2,13 @@
 
 import ReactMarkdown from "react-markdown";
 
-export default function SummaryPanel({ entries, selectedVideos, onCopy }) {
+export default function SummaryPanel({ entries, summaries, selectedVideos, onCopy }) {
   const selectedCount = entries.filter(
-    (video) => selectedVideos[video.url] && video.summary
+    (video) => selectedVideos[video.url] && summaries[video.id]
   ).length;
 
   const selectedSummaries = entries.filter(
-    (video) => selectedVideos[video.url] && video.summary
+    (video) => selectedVideos[video.url] && summaries[video.id]
   );
 
   return (
@@ -28,7 +28,7 @@ export default function SummaryPanel({ entries, selectedVideos, onCopy }) {
                   {video.name}
                 </a>
               </h2>
-              <ReactMarkdown>{video.summary}</ReactMarkdown>
+              <ReactMarkdown>{summaries[video.id]}</ReactMarkdown>
             </article>
           ))
         ) : (
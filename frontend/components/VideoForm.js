@@ -12,8 +12,8 @@ export default function VideoForm({ onVideoAdded }) {
     setMessage("");
 
     try {
-      await addVideo(url);
-      setMessage("Video added successfully.");
+      const data = await addVideo(url);
+      setMessage(data.message || "Video added successfully.");
       setUrl("");
       if (onVideoAdded) {
         onVideoAdded();
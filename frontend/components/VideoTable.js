@@ -73,7 +73,7 @@ export default function VideoTable({ entries, selectedVideos, onToggleSelection,
         {sortedEntries.map((video, index) => (
           <div
             className={`video-row ${
-              !video.summary ? "video-row-disabled" : ""
+              !video.has_summary ? "video-row-disabled" : ""
             }`}
             key={index}
             onClick={(e) => onRowClick(index, video.url, e)}
@@ -87,7 +87,7 @@ export default function VideoTable({ entries, selectedVideos, onToggleSelection,
                   e.stopPropagation();
                   onToggleSelection(video.url, index);
                 }}
-                disabled={!video.summary}
+                disabled={!video.has_summary}
               />
               {video.name}
             </span>
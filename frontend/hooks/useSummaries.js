@@ -0,0 +1,37 @@
+import { useState, useEffect, useRef } from "react";
+import { fetchSummary } from "@/utils/api";
+
+// Fetches the summaries of the selected entries on demand, keyed by entry id.
+// Summaries are written while they are generated, so those of unfinished
+// entries are fetched again whenever the entries change.
+export function useSummaries(entries, selectedVideos) {
+  const [summaries, setSummaries] = useState({});
+  // Entry status at the time each summary was fetched
+  const fetchedRef = useRef(new Map());
+  const loadingRef = useRef(new Set());
+
+  useEffect(() => {
+    const stale = entries.filter(
+      (video) =>
+        selectedVideos[video.url] &&
+        video.has_summary &&
+        !loadingRef.current.has(video.id) &&
+        fetchedRef.current.get(video.id) !== "done"
+    );
+
+    stale.forEach(async (video) => {
+      loadingRef.current.add(video.id);
+      try {
+        const summary = await fetchSummary(video.id);
+        fetchedRef.current.set(video.id, video.status);
+        setSummaries((prev) => ({ ...prev, [video.id]: summary }));
+      } catch (err) {
+        console.error(err);
+      } finally {
+        loadingRef.current.delete(video.id);
+      }
+    });
+  }, [entries, selectedVideos]);
+
+  return summaries;
+}
@@ -1,30 +1,62 @@
-import { useState, useEffect } from "react";
-import { fetchEntries } from "@/utils/api";
+import { useState, useEffect, useRef } from "react";
+import { fetchEntries, subscribeToEntryEvents } from "@/utils/api";
 
-const POLL_INTERVAL = parseInt(process.env.NEXT_PUBLIC_POLL_INTERVAL) || 1000;
+// Status changes arrive as server-sent events; this slow poll only resyncs in
+// case the event stream missed something
+const POLL_INTERVAL = parseInt(process.env.NEXT_PUBLIC_POLL_INTERVAL) || 60000;
 
 export function useVideos() {
   const [entries, setEntries] = useState([]);
   const [error, setError] = useState(null);
   const [isLoading, setIsLoading] = useState(true);
+  const entriesRef = useRef([]);
+
+  const applyEntries = (data) => {
+    entriesRef.current = data;
+    setEntries(data);
+  };
+
+  const loadEntries = async () => {
+    try {
+      const data = await fetchEntries();
+      applyEntries(data);
+      setError(null);
+    } catch (err) {
+      setError(err.message);
+    } finally {
+      setIsLoading(false);
+    }
+  };
 
   useEffect(() => {
-    const loadEntries = async () => {
-      try {
-        const data = await fetchEntries();
-        setEntries(data);
-        setError(null);
-      } catch (err) {
-        setError(err.message);
-      } finally {
-        setIsLoading(false);
+    const applyEvent = (event) => {
+      const current = entriesRef.current;
+      const index = current.findIndex((video) => video.id === event.id);
+
+      // Bulk imports and new entries need data the event doesn't carry
+      if (event.refresh || index === -1) {
+        loadEntries();
+        return;
       }
+
+      const updated = [...current];
+      updated[index] = {
+        ...current[index],
+        status: event.status,
+        name: event.name,
+        has_summary: event.summary_available,
+      };
+      applyEntries(updated);
     };
 
-    loadEntries();
+    // Loading on every (re)connect catches up on events missed while disconnected
+    const unsubscribe = subscribeToEntryEvents(applyEvent, loadEntries);
     const interval = setInterval(loadEntries, POLL_INTERVAL);
-    return () => clearInterval(interval);
+    return () => {
+      unsubscribe();
+      clearInterval(interval);
+    };
   }, []);
 
-  return { entries, error, isLoading, refetch: () => fetchEntries().then(setEntries) };
+  return { entries, error, isLoading, refetch: loadEntries };
 }
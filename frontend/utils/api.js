@@ -15,18 +15,41 @@ const getServerUrl = () => {
 const SERVER = getServerUrl();
 
 export async function fetchEntries() {
-  const response = await fetch(`${SERVER}/entries`);
+  // Revalidate with the ETag from the last response; the server answers 304
+  // with no body when nothing changed
+  const response = await fetch(`${SERVER}/entries`, { cache: "no-cache" });
   if (!response.ok) {
     throw new Error(`Failed to fetch entries: ${response.status}`);
   }
   return response.json();
 }
 
+export async function fetchSummary(id) {
+  // Summaries of finished entries are cached by the browser for good
+  const response = await fetch(`${SERVER}/entries/${id}/summary`);
+  if (!response.ok) {
+    throw new Error(`Failed to fetch summary: ${response.status}`);
+  }
+  return response.text();
+}
+
+// Calls onEvent with each {id, status, name, summary_available} delta the server
+// pushes ({refresh: true} after bulk imports), and onOpen whenever the stream (re)connects. Returns a function that
+// closes the stream.
+export function subscribeToEntryEvents(onEvent, onOpen) {
+  const source = new EventSource(`${SERVER}/entries/events`);
+  source.onmessage = (message) => onEvent(JSON.parse(message.data));
+  source.onopen = onOpen;
+  return () => source.close();
+}
+
 export async function addVideo(url) {
+  // Someone is waiting on videos added from the UI, so they skip ahead of
+  // bulk imports
   const response = await fetch(`${SERVER}/entries`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ url }),
+    body: JSON.stringify({ url, interactive: true }),
   });
   const data = await response.json();
   if (!response.ok) {